@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ジェネレーターのベンチマーク
+合成YAML（大問×小問数、Markdown密度、注意事項の長さ、展開の行数）を規模別に作成し、
+ExamGenerator / WorksheetGenerator / LessonPlanGenerator（HTML・Word）の
+レイテンシ・スループット・ピークメモリ（tracemalloc）を計測してJSONに保存する
+
+使い方:
+    python bench_generators.py                      # 既定の規模で計測し bench_results/ に保存
+    python bench_generators.py --scales 1x1 30x20   # 大問x小問 の規模を指定
+    python bench_generators.py --warm               # キャッシュを効かせた状態で計測
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+from datetime import datetime
+
+import yaml
+
+from exam_generator import ExamGenerator
+from lesson_plan_generator import LessonPlanGenerator
+from markdown_engine import markdown_engine
+from models import document_caches
+from render_cache import fragment_cache
+from worksheet_generator import WorksheetGenerator
+from yaml_loader import parsed_cache
+
+
+def _markdown_text(label: str, density: float) -> str:
+    """density（0〜1）に応じてMarkdown要素・数式を含む本文を作成"""
+    parts = [f"{label}について、次の問いに答えよ。"]
+    if density >= 0.25:
+        parts.append(f"**重要** な条件は $x^2 + {len(label)}x + 1 = 0$ である。")
+    if density >= 0.5:
+        parts.append("\n\n- 条件1: $a > 0$\n- 条件2: $b < 0$\n- 条件3: *整数解* をもつ")
+    if density >= 0.75:
+        parts.append("\n\n| x | y |\n|---|---|\n| 1 | 2 |\n\n> 参考: `f(x)` の定義に注意すること。")
+    return " ".join(parts)
+
+
+def build_exam_yaml(questions: int, subs: int, density: float = 0.5, notes: int = 5) -> str:
+    """大問 questions 個 × 小問 subs 個の定期考査YAMLを作成"""
+    data = {
+        'タイトル': '合成 定期考査',
+        'サブタイトル': 'ベンチマーク',
+        '学校名': '〇〇高校',
+        '科目': '数学',
+        '試験時間': 50,
+        '注意事項': [f"注意事項{i + 1}：解答はすべて解答用紙に記入すること。" for i in range(notes)],
+        '大問': [
+            {
+                '番号': q + 1,
+                'タイトル': f"大問{q + 1}",
+                '必須': q % 2 == 0,
+                '配点': 10,
+                '改ページ': q > 0 and q % 5 == 0,
+                '小問': [
+                    {
+                        '番号': f"({s + 1})",
+                        '本文': _markdown_text(f"問{q + 1}-{s + 1}", density),
+                        '解答': f"${s + 1}$",
+                        '解説': _markdown_text(f"解説{q + 1}-{s + 1}", density),
+                    }
+                    for s in range(subs)
+                ],
+            }
+            for q in range(questions)
+        ],
+    }
+    return yaml.safe_dump(data, allow_unicode=True, sort_keys=False)
+
+
+def build_worksheet_yaml(problems: int, subs: int, density: float = 0.5) -> str:
+    """問題 problems 個（各 小問 subs 個）のプリントYAMLを作成"""
+    items = []
+    for p in range(problems):
+        if p % 10 == 0:
+            items.append({'type': 'header', 'text': f"セクション{p // 10 + 1}"})
+        items.append({
+            '本文': _markdown_text(f"問題{p + 1}", density),
+            '配点': 5,
+            '小問': [{'番号': f"({s + 1})", '本文': f"小問{s + 1}"} for s in range(subs)],
+            '解答': [f"答{s + 1}" for s in range(subs)] or [f"答{p + 1}"],
+            '解説': _markdown_text(f"解説{p + 1}", density),
+        })
+    data = {'タイトル': '合成プリント', 'サブタイトル': 'ベンチマーク', '問題': items}
+    return yaml.safe_dump(data, allow_unicode=True, sort_keys=False)
+
+
+def build_lesson_plan_yaml(rows: int) -> str:
+    """展開が rows 行の指導案YAMLを作成"""
+    flow = {}
+    for i in range(rows):
+        flow[f"活動{i + 1}"] = {
+            '時間': 5,
+            '学習内容': [f"学習内容{i + 1}-{j}" for j in range(2)],
+            '学習活動': [f"学習活動{i + 1}-{j}" for j in range(3)],
+            '留意点': [f"留意点{i + 1}-{j}" for j in range(2)],
+        }
+    data = {
+        '教科': '数学',
+        '日時': '2026年10月1日',
+        '学校名': '〇〇高校',
+        '対象': '1年1組',
+        '会場': '教室',
+        '授業者': '山田',
+        '単元名': '二次関数',
+        '使用教科書': '数学Ⅰ',
+        '本時の目標': ['グラフをかける', '最大・最小を求める'],
+        '展開': flow,
+        '評価': [{'規準': 'グラフをかける'}],
+    }
+    return yaml.safe_dump(data, allow_unicode=True, sort_keys=False)
+
+
+def _clear_caches():
+    fragment_cache.clear()
+    markdown_engine.clear()
+    parsed_cache.clear()
+    for cache in document_caches.values():
+        cache.clear()
+
+
+def measure(render, yaml_content: str, repeat: int, warm: bool) -> dict:
+    """render(yaml_content) を repeat 回実行し、レイテンシ・スループット・ピークメモリを返す"""
+    render(yaml_content)  # ウォームアップ（import・テンプレート読み込みなど）
+    latencies = []
+    output_bytes = 0
+    for _ in range(repeat):
+        if not warm:
+            _clear_caches()
+        start = time.perf_counter()
+        output = render(yaml_content)
+        latencies.append(time.perf_counter() - start)
+        output_bytes = len(output.encode('utf-8')) if isinstance(output, str) else len(output)
+
+    if not warm:
+        _clear_caches()
+    tracemalloc.start()
+    render(yaml_content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        'input_bytes': len(yaml_content.encode('utf-8')),
+        'output_bytes': output_bytes,
+        'repeat': repeat,
+        'latency_ms': {
+            'min': latencies[0] * 1000,
+            'median': statistics.median(latencies) * 1000,
+            'mean': total / repeat * 1000,
+            'p95': latencies[min(repeat - 1, int(repeat * 0.95))] * 1000,
+            'max': latencies[-1] * 1000,
+        },
+        'throughput_per_s': repeat / total if total else None,
+        'peak_memory_bytes': peak,
+    }
+
+
+def run(scales, densities, notes, rows_list, repeat, warm) -> list[dict]:
+    results = []
+
+    def record(generator, params, yaml_content, render):
+        result = {'generator': generator, 'params': params, **measure(render, yaml_content, repeat, warm)}
+        results.append(result)
+        print(f"{generator:<18} {json.dumps(params, ensure_ascii=False):<52} "
+              f"median {result['latency_ms']['median']:9.2f} ms  "
+              f"peak {result['peak_memory_bytes'] / 1024:9.1f} KiB")
+
+    for questions, subs in scales:
+        for density in densities:
+            params = {'大問': questions, '小問': subs, 'markdown_density': density, '注意事項': notes}
+            record('exam', params, build_exam_yaml(questions, subs, density, notes),
+                   lambda y: ExamGenerator(y).generate_html())
+            params = {'問題': questions, '小問': subs, 'markdown_density': density}
+            record('worksheet', params, build_worksheet_yaml(questions, subs, density),
+                   lambda y: WorksheetGenerator(y).generate_html())
+
+    for rows in rows_list:
+        params = {'展開': rows}
+        lesson_yaml = build_lesson_plan_yaml(rows)
+        record('lesson-plan-html', params, lesson_yaml, lambda y: LessonPlanGenerator(y).generate_html())
+        record('lesson-plan-docx', params, lesson_yaml, lambda y: LessonPlanGenerator(y).generate_docx_bytes())
+
+    return results
+
+
+def _parse_scale(value: str) -> tuple[int, int]:
+    questions, _, subs = value.partition('x')
+    return int(questions), int(subs or 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ジェネレーターのベンチマーク")
+    parser.add_argument('--scales', nargs='+', type=_parse_scale, default=[(3, 5), (10, 10), (30, 20)],
+                        help="大問x小問（プリントは 問題x小問）の規模 例: 10x10")
+    parser.add_argument('--densities', nargs='+', type=float, default=[0.0, 1.0],
+                        help="Markdown密度（0〜1）")
+    parser.add_argument('--notes', type=int, default=5, help="注意事項の行数")
+    parser.add_argument('--rows', nargs='+', type=int, default=[5, 50, 500], help="指導案の展開の行数")
+    parser.add_argument('--repeat', type=int, default=10, help="各条件の繰り返し回数")
+    parser.add_argument('--warm', action='store_true', help="断片・Markdown・YAMLキャッシュを消さずに計測")
+    parser.add_argument('--output', help="結果JSONの保存先（既定: bench_results/<日時>.json）")
+    args = parser.parse_args()
+
+    results = run(args.scales, args.densities, args.notes, args.rows, args.repeat, args.warm)
+
+    output = args.output or os.path.join('bench_results', datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'warm': args.warm,
+            'results': results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\n結果を保存しました: {output}")
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+指導案Word生成のベンチマーク
+展開の行数（5 / 50 / 500）ごとに、1リクエストあたりのDOCX生成時間を計測する
+
+使い方: python bench_lesson_plan_docx.py [繰り返し回数]
+"""
+
+import sys
+import time
+
+from bench_generators import build_lesson_plan_yaml
+from lesson_plan_generator import LessonPlanGenerator
+
+
+def bench(rows: int, repeat: int) -> float:
+    """1リクエストあたりの平均時間（ミリ秒）"""
+    generator = LessonPlanGenerator(build_lesson_plan_yaml(rows))
+    generator.generate_docx_bytes()  # ウォームアップ
+    start = time.perf_counter()
+    for _ in range(repeat):
+        generator.generate_docx_bytes()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+if __name__ == "__main__":
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print(f"{'展開行数':>8} {'DOCX生成 (ms/件)':>18}")
+    for rows in (5, 50, 500):
+        print(f"{rows:>8} {bench(rows, repeat):>18.2f}")
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+差分ビルド
+ディレクトリ配下のYAMLを出力ディレクトリへ HTML（指導案は DOCX も）として書き出す。
+入力の内容ハッシュと生成コードのバージョンをマニフェストに記録し、
+どちらも前回と同じ文書は生成し直さない
+
+使い方: python build.py <入力ディレクトリ> <出力ディレクトリ> [--workers N] [--force]
+"""
+
+import hashlib
+import importlib
+import importlib.metadata
+import json
+import os
+import sys
+import time
+
+import yaml
+
+from bulk_export import find_documents, print_progress, render_in_pool
+from exam_generator import EXAM_CSS
+from lesson_plan_generator import LESSON_PLAN_CSS
+from mathjax import DEFAULT_URL as MATHJAX_URL, MATHJAX_DIR, MATHJAX_VERSION, VERSION_FILE
+from render_cache import content_hash
+from worksheet_generator import WORKSHEET_CSS
+from yaml_loader import SafeLoader
+
+MANIFEST_NAME = '.kyozai-build.json'
+MANIFEST_FORMAT = 1
+
+# 文書種別ごとに、出力に影響するモジュール（内容が変わればその種別の文書は生成し直す）
+_COMMON_MODULES = ('yaml_loader', 'models', 'stylesheets', 'mathjax', 'bulk_export')
+GENERATOR_MODULES = {
+    'exam': ('exam_generator', 'markdown_engine', *_COMMON_MODULES),
+    'worksheet': ('worksheet_generator', 'markdown_engine', *_COMMON_MODULES),
+    'lesson-plan': ('lesson_plan_generator', *_COMMON_MODULES),
+    None: ('yaml_loader',),  # 種別を判定できなかった文書
+}
+
+
+# 出力に影響するライブラリ（版が変われば、その種別の文書を生成し直す）
+_COMMON_LIBRARIES = ('PyYAML',)
+GENERATOR_LIBRARIES = {
+    'exam': ('Markdown', *_COMMON_LIBRARIES),
+    'worksheet': ('Markdown', *_COMMON_LIBRARIES),
+    'lesson-plan': ('python-docx', *_COMMON_LIBRARIES),
+    None: _COMMON_LIBRARIES,
+}
+
+
+def _library_version(name: str) -> str:
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return 'missing'
+
+
+def _asset_digest(path: str) -> str:
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()[:16]
+    except OSError:
+        return 'missing'
+
+
+def environment() -> dict:
+    """生成コード以外で出力に影響するもの（ライブラリの版・YAMLローダー・スタイルシート・MathJax）"""
+    libyaml = yaml.__with_libyaml__ and yaml._yaml.get_version_string()
+    return {
+        'libraries': {name: _library_version(name) for name in ('Markdown', 'python-docx', 'PyYAML')},
+        'yaml_loader': f'{SafeLoader.__name__} (libyaml {libyaml})' if libyaml else SafeLoader.__name__,
+        'stylesheets': {
+            doctype: hashlib.sha256(css.encode('utf-8')).hexdigest()[:16]
+            for doctype, css in (('exam', EXAM_CSS), ('worksheet', WORKSHEET_CSS), ('lesson-plan', LESSON_PLAN_CSS))
+        },
+        'mathjax': {
+            'url': MATHJAX_URL,
+            'version': MATHJAX_VERSION,
+            'bundle': _asset_digest(os.path.join(MATHJAX_DIR, VERSION_FILE)),
+        },
+    }
+
+
+def generator_versions(env: dict | None = None) -> dict:
+    """文書種別 → 生成コードのバージョン
+    （モジュールのソース・ライブラリの版・YAMLローダー・スタイルシート・MathJax のハッシュ）"""
+    env = env or environment()
+    sources = {}
+    versions = {}
+    for doctype, modules in GENERATOR_MODULES.items():
+        digest = hashlib.sha256(json.dumps({
+            'libraries': {name: env['libraries'][name] for name in GENERATOR_LIBRARIES[doctype]},
+            'yaml_loader': env['yaml_loader'],
+            'stylesheet': env['stylesheets'].get(doctype),
+            'mathjax': env['mathjax'],
+        }, sort_keys=True).encode('utf-8'))
+        for name in modules:
+            if name not in sources:
+                with open(importlib.import_module(name).__file__, 'rb') as f:
+                    sources[name] = f.read()
+            digest.update(sources[name])
+        versions[doctype] = digest.hexdigest()[:16]
+    return versions
+
+
+def load_manifest(out_dir: str) -> dict:
+    try:
+        with open(os.path.join(out_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('format') != MANIFEST_FORMAT:
+        return {}
+    return manifest.get('files', {})
+
+
+def _write_atomic(path: str, content: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+def _remove_output(out_dir: str, name: str):
+    try:
+        os.remove(os.path.join(out_dir, name))
+    except FileNotFoundError:
+        pass
+
+
+def build(src_dir: str, out_dir: str, max_workers: int | None = None, force: bool = False,
+          progress=None) -> dict:
+    """変更のあった文書だけを生成して out_dir に書き出し、集計を返す"""
+    src_dir = os.path.abspath(src_dir)
+    out_dir = os.path.abspath(out_dir)
+    start = time.perf_counter()
+    env = environment()
+    versions = generator_versions(env)
+    previous = {} if force else load_manifest(out_dir)
+    manifest = {}
+    summary = {'total': 0, 'rendered': 0, 'unchanged': 0, 'skipped': 0, 'error': 0, 'removed': 0}
+    errors = []
+
+    stale = []
+    hashes = {}
+    for path in find_documents(src_dir):
+        relative = os.path.relpath(path, src_dir).replace(os.sep, '/')
+        summary['total'] += 1
+        with open(path, 'rb') as f:
+            digest = content_hash(f.read().decode('utf-8', errors='replace'))
+        hashes[relative] = digest
+        entry = previous.get(relative)
+        if (entry is not None
+                and entry['hash'] == digest
+                and entry['generator_version'] == versions.get(entry['doctype'])
+                and all(os.path.exists(os.path.join(out_dir, name)) for name in entry['outputs'])):
+            manifest[relative] = entry
+            summary['unchanged'] += 1
+        else:
+            stale.append(path)
+
+    for result in render_in_pool(src_dir, stale, max_workers):
+        relative = result['path']
+        old_outputs = set(previous.get(relative, {}).get('outputs', []))
+        if result['status'] == 'error':
+            # 前回の出力は残し、次回のビルドで再試行する
+            summary['error'] += 1
+            errors.append(result)
+            if relative in previous:
+                manifest[relative] = previous[relative]
+        else:
+            names = []
+            for name, content in result['outputs']:
+                _write_atomic(os.path.join(out_dir, name), content)
+                names.append(name)
+            for name in old_outputs - set(names):
+                _remove_output(out_dir, name)
+            manifest[relative] = {
+                'hash': hashes[relative],
+                'doctype': result['doctype'],
+                'generator_version': versions[result['doctype']],
+                'outputs': names,
+            }
+            summary['rendered' if result['status'] == 'ok' else 'skipped'] += 1
+        if progress is not None:
+            progress(summary['unchanged'] + summary['rendered'] + summary['skipped'] + summary['error'],
+                     summary['total'], result)
+
+    # 入力が消えた文書の出力を削除
+    for relative, entry in previous.items():
+        if relative not in hashes:
+            for name in entry['outputs']:
+                _remove_output(out_dir, name)
+            summary['removed'] += 1
+
+    os.makedirs(out_dir, exist_ok=True)
+    _write_atomic(
+        os.path.join(out_dir, MANIFEST_NAME),
+        json.dumps({'format': MANIFEST_FORMAT, 'environment': env, 'files': manifest}, ensure_ascii=False, indent=2).encode('utf-8'),
+    )
+    summary['elapsed_seconds'] = round(time.perf_counter() - start, 3)
+    summary['errors'] = [{'path': r['path'], 'error': r['error']} for r in errors]
+    return summary
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    workers = None
+    force = '--force' in args
+    if force:
+        args.remove('--force')
+    if '--workers' in args:
+        i = args.index('--workers')
+        workers = int(args[i + 1])
+        del args[i:i + 2]
+    if len(args) != 2:
+        print(__doc__)
+        sys.exit(1)
+    summary = build(args[0], args[1], workers, force, progress=print_progress)
+    print(f"生成: {summary['rendered']}件 / 変更なし: {summary['unchanged']}件 / スキップ: {summary['skipped']}件 / "
+          f"削除: {summary['removed']}件 / エラー: {summary['error']}件 ({summary['elapsed_seconds']}秒)")
+    sys.exit(1 if summary['error'] else 0)
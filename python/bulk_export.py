@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+一括エクスポート
+ディレクトリ配下のYAMLの文書種別を判定してプロセスプール（サーバーでは一括生成と共有）で生成し、
+HTML（指導案はDOCXも）を生成し終えたものから順にZIPへ書き込む。
+同時に保持する生成結果はワーカー数の2倍までなので、全体をメモリに載せることはない
+
+使い方: python bulk_export.py <ディレクトリ> <出力.zip> [--workers N]
+"""
+
+import asyncio
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from lesson_plan_generator import generate_lesson_plan_docx_bytes
+from metrics import call_capturing, registry
+from workers import RENDERERS
+from yaml_loader import detect_doctype, load_yaml
+
+YAML_EXTENSIONS = ('.yaml', '.yml')
+REPORT_NAME = '_export_report.json'
+STREAM_CHUNK_BYTES = 256 * 1024
+
+export_logger = logging.getLogger('kyozai.export')
+
+
+class ExportCancelled(Exception):
+    """呼び出し側の中断要求によりエクスポートを打ち切った"""
+
+
+def find_documents(root: str) -> list[str]:
+    """root 配下のYAMLファイル（パス順）"""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith(YAML_EXTENSIONS):
+                paths.append(os.path.join(dirpath, filename))
+    return paths
+
+
+def render_file(root: str, path: str) -> dict:
+    """1ファイルを生成（ワーカープロセス内で呼ぶ）。
+    outputs は ZIP 内の名前と内容の組のリスト"""
+    relative = os.path.relpath(path, root).replace(os.sep, '/')
+    result = {'path': relative, 'doctype': None, 'status': 'ok', 'error': None, 'outputs': []}
+    try:
+        with open(path, encoding='utf-8') as f:
+            yaml_content = f.read()
+        doctype = detect_doctype(load_yaml(yaml_content))
+        if doctype is None:
+            result['status'] = 'skipped'
+            return result
+        result['doctype'] = doctype
+        base = os.path.splitext(relative)[0]
+        result['outputs'].append((f'{base}.html', RENDERERS[doctype](yaml_content).encode('utf-8')))
+        if doctype == 'lesson-plan':
+            result['outputs'].append((f'{base}.docx', generate_lesson_plan_docx_bytes(yaml_content)))
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = f'{type(e).__name__}: {e}'
+        result['outputs'] = []
+    return result
+
+
+def render_in_pool(root: str, paths: list[str], max_workers: int | None = None,
+                   executor: ProcessPoolExecutor | None = None):
+    """paths をプロセスプールで生成し、終わったものから render_file の結果を返すイテレータ。
+    executor を渡すとそのプールを使い（終了はさせない）、なければこの呼び出し用に起動する。
+    処理中の件数はワーカー数の2倍までに抑える（途中で閉じると残りは取り消す）"""
+    max_workers = max_workers or os.cpu_count() or 1
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            yield from render_in_pool(root, paths, max_workers, executor)
+        return
+    window = max_workers * 2
+    pending = set()
+    queued = iter(paths)
+    try:
+        while True:
+            for path in queued:
+                pending.add(executor.submit(call_capturing, render_file, root, path))
+                if len(pending) >= window:
+                    break
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result, records = future.result()
+                registry.replay(records)
+                yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def export_zip(root: str, out, max_workers: int | None = None, progress=None, cancelled=None,
+               executor: ProcessPoolExecutor | None = None) -> dict:
+    """root 配下の文書を生成して out（パスまたは書き込み可能なファイルオブジェクト）にZIPで書き出す。
+
+    progress(完了数, 総数, 結果) は1ファイル終わるごとに呼ばれる。
+    cancelled() が True を返すと ExportCancelled で打ち切る。
+    戻り値は件数の集計と、ファイルごとの結果（ZIP内にも REPORT_NAME として保存する）
+    """
+    root = os.path.abspath(root)
+    paths = find_documents(root)
+    summary = {'total': len(paths), 'ok': 0, 'skipped': 0, 'error': 0}
+    files = []
+    start = time.perf_counter()
+
+    with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        results = render_in_pool(root, paths, max_workers, executor)
+        try:
+            for result in results:
+                for name, content in result.pop('outputs'):
+                    archive.writestr(name, content)
+                summary[result['status']] += 1
+                files.append(result)
+                if progress is not None:
+                    progress(len(files), len(paths), result)
+                if cancelled is not None and cancelled():
+                    raise ExportCancelled()
+        finally:
+            results.close()
+
+        report = {**summary, 'elapsed_seconds': round(time.perf_counter() - start, 3),
+                  'files': sorted(files, key=lambda r: r['path'])}
+        archive.writestr(REPORT_NAME, json.dumps(report, ensure_ascii=False, indent=2))
+    return report
+
+
+class _QueueWriter:
+    """ZIPの出力をまとめて上限付きキューへ送るファイルオブジェクト（シーク不可）"""
+
+    def __init__(self, chunks: queue.Queue, cancel: threading.Event):
+        self._chunks = chunks
+        self._cancel = cancel
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        if len(self._buffer) >= STREAM_CHUNK_BYTES:
+            self.put(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        if self._buffer:
+            self.put(bytes(self._buffer))
+            self._buffer.clear()
+
+    def put(self, item):
+        # 受信側が遅ければここで待つ（生成側が先に進みすぎない）
+        while not self._cancel.is_set():
+            try:
+                self._chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        raise ExportCancelled()
+
+
+async def stream_export_zip(root: str, max_workers: int | None = None,
+                            executor: ProcessPoolExecutor | None = None):
+    """export_zip の出力をチャンクごとに返す非同期イテレータ（StreamingResponse 用）。
+    途中で受信をやめると（クライアント切断など）生成を打ち切る"""
+    chunks: queue.Queue = queue.Queue(maxsize=16)
+    cancel = threading.Event()
+
+    def log_progress(done: int, total: int, result: dict):
+        export_logger.info('[%d/%d] %s (%s)', done, total, result['path'], result['error'] or result['status'])
+
+    def run():
+        writer = _QueueWriter(chunks, cancel)
+        try:
+            export_zip(root, writer, max_workers, log_progress, cancel.is_set, executor)
+            writer.drain()
+            writer.put(None)
+        except ExportCancelled:
+            # 受信待ちのスレッドが残らないよう終端を入れておく
+            try:
+                chunks.put_nowait(None)
+            except queue.Full:
+                pass
+        except BaseException as e:
+            try:
+                writer.put(e)
+            except ExportCancelled:
+                pass
+
+    threading.Thread(target=run, name='bulk-export', daemon=True).start()
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            item = await loop.run_in_executor(None, chunks.get)
+            if item is None:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        cancel.set()
+
+
+def print_progress(done: int, total: int, result: dict):
+    status = result['status'] if result['status'] != 'error' else f"error: {result['error']}"
+    print(f'[{done}/{total}] {result["path"]} ({status})', flush=True)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    workers = None
+    if '--workers' in args:
+        i = args.index('--workers')
+        workers = int(args[i + 1])
+        del args[i:i + 2]
+    if len(args) != 2:
+        print(__doc__)
+        sys.exit(1)
+    report = export_zip(args[0], args[1], workers, progress=print_progress)
+    print(f"完了: {report['ok']}件 / スキップ: {report['skipped']}件 / エラー: {report['error']}件 "
+          f"({report['elapsed_seconds']}秒) → {args[1]}")
+    sys.exit(1 if report['error'] else 0)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+レスポンス圧縮とHTML最小化
+Accept-Encoding に応じて gzip（brotli / zstandard がインストールされていればそれも）で圧縮する
+"""
+
+import gzip
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# これより小さい本文は圧縮しない（ヘッダーの方が大きくなるため）
+MIN_COMPRESS_BYTES = 1024
+
+
+def _compressors() -> dict:
+    compressors = {}
+    if brotli is not None:
+        compressors['br'] = lambda data: brotli.compress(data, quality=5)
+    if zstandard is not None:
+        compressors['zstd'] = lambda data: zstandard.ZstdCompressor(level=6).compress(data)
+    compressors['gzip'] = lambda data: gzip.compress(data, compresslevel=6, mtime=0)
+    return compressors
+
+
+# 優先順（先にあるものほど圧縮率が高い）
+COMPRESSORS = _compressors()
+
+
+def negotiate(accept_encoding: str | None) -> str | None:
+    """Accept-Encoding ヘッダーから使用する圧縮方式を選ぶ（なければ None）"""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding in COMPRESSORS:
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > 0:
+            return encoding
+    return None
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    return COMPRESSORS[encoding](data)
+
+
+# 空白を保持する必要がある要素
+_PRESERVE = re.compile(r'(<(pre|textarea)\b.*?</\2>)', re.S | re.I)
+_LEADING_WS = re.compile(r'\n[ \t]+')
+_BLANK_LINES = re.compile(r'\n{2,}')
+
+
+def minify_html(html: str) -> str:
+    """テンプレート由来のインデントと空行を取り除く（pre / textarea の中は変更しない）"""
+    parts = _PRESERVE.split(html)
+    out = []
+    # split の結果は [通常, 保持ブロック, タグ名, 通常, ...] の順に並ぶ
+    for i in range(0, len(parts), 3):
+        text = _LEADING_WS.sub('\n', parts[i])
+        out.append(_BLANK_LINES.sub('\n', text))
+        if i + 1 < len(parts):
+            out.append(parts[i + 1])
+    return ''.join(out).strip()
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ダウンロード用ヘルパー
+教科・タイトルから安全なファイル名を作り、Content-Disposition ヘッダーを組み立てる
+"""
+
+import re
+from urllib.parse import quote
+
+DOCX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+HTML_MEDIA_TYPE = "text/html; charset=utf-8"
+
+# Windows/macOSでファイル名に使えない文字と制御文字
+_UNSAFE_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]+')
+
+
+def safe_filename(*parts, default: str = "document") -> str:
+    """空でない要素を _ で連結し、ファイル名に使えない文字を取り除く"""
+    stem = "_".join(str(p).strip() for p in parts if p and str(p).strip())
+    stem = _UNSAFE_CHARS.sub("", stem).strip(". ")
+    return stem[:100] or default
+
+
+def content_disposition(filename: str, fallback: str) -> str:
+    """日本語ファイル名（RFC 5987）とASCIIの代替名を併記した attachment ヘッダー"""
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
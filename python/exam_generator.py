@@ -5,63 +5,42 @@
 YAMLコンテンツからHTML形式の定期考査問題を生成する
 """
 
-import yaml
-import markdown
+from downloads import safe_filename
+from mathjax import has_math, head_scripts
+from markdown_engine import render_markdown
+from metrics import phase
+from models import load_exam
+from render_cache import fragment_cache, fragment_keys
+from stylesheets import style_block
 
 
-class ExamGenerator:
-    def __init__(self, yaml_content: str):
-        """YAMLコンテンツから初期化"""
-        self.data = yaml.safe_load(yaml_content)
-
-    def generate_html(self) -> str:
-        """HTML文字列を生成して返す"""
-        return self._build_html()
-
-    def _build_html(self):
-        return f"""<!DOCTYPE html>
-<html lang="ja">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{self.data.get('タイトル', self.data.get('試験名', '定期考査'))}</title>
-    <script id="MathJax-script" async src="https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-mml-chtml.js"></script>
-    <script>
-        MathJax = {{
-            tex: {{
-                inlineMath: [['$', '$']],
-                displayMath: [['$$', '$$']],
-                processEscapes: true
-            }}
-        }};
-    </script>
-    <style>
-        @media print {{
-            .page-break {{ 
+EXAM_CSS = """\
+        @media print {
+            .page-break { 
                 display: block;
                 height: 0;
                 page-break-before: always; 
                 break-before: page;
                 clear: both;
-            }}
-            body {{
+            }
+            body {
                 width: 100% !important;
                 max-width: none !important;
                 margin: 0 !important;
                 padding: 0 !important;
-            }}
-            @page {{ size: A4; margin: 15mm; }}
-        }}
+            }
+            @page { size: A4; margin: 15mm; }
+        }
         
         /* 画面プレビュー用：改ページ位置を可視化 */
-        @media screen {{
-            [style*="break-before: page"] {{
+        @media screen {
+            [style*="break-before: page"] {
                 border-top: 4px dashed #ddd !important;
                 margin-top: 40px !important;
                 padding-top: 40px !important;
                 position: relative;
-            }}
-            [style*="break-before: page"]::before {{
+            }
+            [style*="break-before: page"]::before {
                 content: "--- 改ページ ---";
                 display: block;
                 position: absolute;
@@ -73,63 +52,138 @@ class ExamGenerator:
                 font-weight: bold;
                 background: #fff;
                 padding: 0 10px;
-            }}
-        }}
+            }
+        }
 
-        body {{ font-family: 'Hiragino Mincho ProN', 'Yu Mincho', serif; line-height: 1.6; max-width: 210mm; margin: 0 auto; padding: 20px; }}
+        body { font-family: 'Hiragino Mincho ProN', 'Yu Mincho', serif; line-height: 1.6; max-width: 210mm; margin: 0 auto; padding: 20px; }
         
         /* 表紙スタイル */
-        .cover-page {{ min-height: 250mm; display: flex; flex-direction: column; align-items: center; justify-content: center; text-align: center; border: 3px solid #000; padding: 40px; box-sizing: border-box; }}
-        .exam-title {{ font-size: 28pt; font-weight: bold; margin: 20px 0; }}
-        .exam-subtitle {{ font-size: 18pt; margin-bottom: 40px; }}
+        .cover-page { min-height: 250mm; display: flex; flex-direction: column; align-items: center; justify-content: center; text-align: center; border: 3px solid #000; padding: 40px; box-sizing: border-box; }
+        .exam-title { font-size: 28pt; font-weight: bold; margin: 20px 0; }
+        .exam-subtitle { font-size: 18pt; margin-bottom: 40px; }
         
         /* 情報欄 */
-        .exam-info {{ width: 100%; margin: 30px 0; text-align: center; }}
-        .exam-info p {{ margin: 10px 0; font-size: 14pt; }}
+        .exam-info { width: 100%; margin: 30px 0; text-align: center; }
+        .exam-info p { margin: 10px 0; font-size: 14pt; }
         
         /* 注意事項 */
-        .exam-notes {{ border: 2px solid #000; padding: 20px; width: 80%; margin: 30px auto; text-align: left; font-size: 11pt; background-color: #fafafa; }}
-        .exam-notes h3 {{ margin-top: 0; text-align: center; text-decoration: underline; }}
-        .exam-notes ul {{ padding-left: 20px; }}
-        .exam-notes li {{ margin-bottom: 10px; }}
+        .exam-notes { border: 2px solid #000; padding: 20px; width: 80%; margin: 30px auto; text-align: left; font-size: 11pt; background-color: #fafafa; }
+        .exam-notes h3 { margin-top: 0; text-align: center; text-decoration: underline; }
+        .exam-notes ul { padding-left: 20px; }
+        .exam-notes li { margin-bottom: 10px; }
 
         /* 生徒記入欄 */
-        .student-box {{ width: 90%; margin: 60px auto 0; border: 2px solid #000; padding: 20px; }}
-        .input-row {{ display: flex; justify-content: space-between; align-items: baseline; font-size: 14pt; }}
-        .input-group {{ display: flex; gap: 20px; }}
-        .input-label {{ font-weight: bold; }}
-        .input-line {{ border-bottom: 1px solid #000; min-width: 300px; display: inline-block; }}
+        .student-box { width: 90%; margin: 60px auto 0; border: 2px solid #000; padding: 20px; }
+        .input-row { display: flex; justify-content: space-between; align-items: baseline; font-size: 14pt; }
+        .input-group { display: flex; gap: 20px; }
+        .input-label { font-weight: bold; }
+        .input-line { border-bottom: 1px solid #000; min-width: 300px; display: inline-block; }
         
         /* 問題ページ */
-        .problem-page {{ padding: 10px; }}
-        .problem-header {{ border-bottom: 2px solid #000; margin-bottom: 25px; padding-bottom: 10px; display: flex; justify-content: space-between; align-items: baseline; }}
-        .problem-title {{ font-size: 16pt; font-weight: bold; }}
-        .problem-type {{ font-size: 12pt; border: 1px solid #000; padding: 2px 10px; border-radius: 4px; margin-left: 10px; }}
-        .problem-score {{ font-weight: bold; }}
+        .problem-page { padding: 10px; }
+        .problem-header { border-bottom: 2px solid #000; margin-bottom: 25px; padding-bottom: 10px; display: flex; justify-content: space-between; align-items: baseline; }
+        .problem-title { font-size: 16pt; font-weight: bold; }
+        .problem-type { font-size: 12pt; border: 1px solid #000; padding: 2px 10px; border-radius: 4px; margin-left: 10px; }
+        .problem-score { font-weight: bold; }
         
-        .problem-content {{ font-size: 11pt; }}
-        .problem-item {{ margin-bottom: 30px; }}
-        .problem-item-num {{ float: left; font-weight: bold; margin-right: 10px; font-size: 12pt; }}
-        .problem-item-body {{ overflow: hidden; }}
+        .problem-content { font-size: 11pt; }
+        .problem-item { margin-bottom: 30px; }
+        .problem-item-num { float: left; font-weight: bold; margin-right: 10px; font-size: 12pt; }
+        .problem-item-body { overflow: hidden; }
 
         /* 解答解説ページ */
-        .answer-page h2 {{ border-bottom: 3px double #000; padding-bottom: 10px; }}
-        .answer-item {{ margin-bottom: 20px; border-bottom: 1px dashed #ccc; padding-bottom: 10px; }}
-        .answer-correct {{ font-weight: bold; font-size: 12pt; color: #d00; }}
-        .answer-explanation {{ margin-top: 10px; font-size: 10pt; color: #555; background: #f9f9f9; padding: 10px; border-radius: 5px; }}
-    </style>
-</head>
-<body>
-    {self._create_cover()}
-    <div class="page-break"></div>
-    {self._create_problems()}
-    <div class="page-break"></div>
-    {self._create_answers()}
-</body>
-</html>"""
+        .answer-page h2 { border-bottom: 3px double #000; padding-bottom: 10px; }
+        .answer-item { margin-bottom: 20px; border-bottom: 1px dashed #ccc; padding-bottom: 10px; }
+        .answer-correct { font-weight: bold; font-size: 12pt; color: #d00; }
+        .answer-explanation { margin-top: 10px; font-size: 10pt; color: #555; background: #f9f9f9; padding: 10px; border-radius: 5px; }"""
+
+
+# 選択肢の記号（小問の 選択肢 リストの順に振る）
+CHOICE_LABELS = 'アイウエオカキクケコサシスセソ'
+
+
+def choice_label(position: int) -> str:
+    return CHOICE_LABELS[position] if position < len(CHOICE_LABELS) else str(position + 1)
+
+
+def choices_html(choices, order=None) -> str:
+    """選択肢の一覧。order は表示順に並べた元の位置（省略時は元の順）"""
+    order = range(len(choices)) if order is None else order
+    items = ''.join(
+        f'<li><span class="choice-label">{choice_label(pos)}</span> {choices[i]}</li>'
+        for pos, i in enumerate(order)
+    )
+    return f'<ul class="choices" style="list-style: none; padding-left: 1em;">{items}</ul>'
+
+
+class ExamGenerator:
+    def __init__(self, yaml_content: str, stylesheet_url: str | None = None, mathjax_url: str | None = None):
+        """YAMLコンテンツから初期化（stylesheet_url 指定時はCSSを外部参照に、mathjax_url 指定時はそこからMathJaxを読み込む）"""
+        with phase('exam', 'yaml_parse'):
+            self.document = load_exam(yaml_content)
+        self.stylesheet_url = stylesheet_url
+        self.mathjax_url = mathjax_url
+        self.uses_math = has_math(yaml_content)
+
+    def generate_html(self) -> str:
+        """HTML文字列を生成して返す"""
+        return self._build_html()
+
+    def download_name(self) -> str:
+        """ダウンロード時のファイル名（拡張子なし）"""
+        doc = self.document
+        return safe_filename(doc.subject, '定期考査' if doc.title is None else doc.title, default='定期考査')
+
+    def iter_html(self):
+        """HTMLを断片ごとに順次生成（ストリーミング用）"""
+        for _, html in self.iter_fragments():
+            yield html
+
+    def iter_fragments(self, known=frozenset()):
+        """(断片ID, HTML) を文書順に生成。連結すると generate_html() と同じ内容になる。
+
+        大問と解答の断片IDは大問の内容のハッシュから作るので、並べ替えや前後の編集では変わらない。
+        known に含まれるIDの大問・解答は生成せず、HTMLを None にする（ライブプレビュー用）
+        """
+        keys = fragment_keys(section.digest for section in self.document.sections)
+        yield 'head', self._create_head() + '\n<body>\n    '
+        yield 'cover', self._create_cover() + '\n    <div class="page-break"></div>\n    '
+        skip = {i for i, key in enumerate(keys) if f'problem-{key}' in known}
+        for key, html in zip(keys, self._iter_problems(skip)):
+            yield f'problem-{key}', html
+        yield 'answers-head', '\n    <div class="page-break"></div>\n    ' + self._create_answers_head()
+        skip = {i for i, key in enumerate(keys) if f'answer-{key}' in known}
+        for key, html in zip(keys, self._iter_answers(skip)):
+            yield f'answer-{key}', html
+        yield 'answers-tail', '</div>'
+        yield 'tail', '\n</body>\n</html>'
+
+    def _build_html(self):
+        with phase('exam', 'html_assembly'):
+            return ''.join(self.iter_html())
+
+    def _mathjax_scripts(self):
+        """数式を含む文書のときだけMathJaxを読み込む"""
+        if not self.uses_math:
+            return ''
+        return head_scripts(self.mathjax_url)
+
+    def _create_head(self):
+        return f"""<!DOCTYPE html>
+<html lang="ja">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{'定期考査' if self.document.title is None else self.document.title}</title>
+{self._mathjax_scripts()}{style_block(EXAM_CSS, self.stylesheet_url)}
+</head>"""
+
+    def _cover_subtitle(self):
+        return self.document.subtitle
 
     def _create_cover(self):
-        notes = self.data.get('注意事項', [])
+        doc = self.document
+        notes = doc.notes
         notes_html = "\n".join([f"<li>{note}</li>" for note in notes])
         
         # 注意事項の行数に応じてスタイルを調整（6行以上で縮小開始）
@@ -147,8 +201,8 @@ class ExamGenerator:
             notes_style = "font-size: 11pt; line-height: 1.6;"
             li_style = "margin-bottom: 10px;"
         
-        title = self.data.get('タイトル', self.data.get('試験名', ''))
-        subtitle = self.data.get('サブタイトル', '')
+        title = '' if doc.title is None else doc.title
+        subtitle = self._cover_subtitle()
         
         return f"""
     <div class="cover-page">
@@ -156,9 +210,9 @@ class ExamGenerator:
         <div class="exam-subtitle">{subtitle}</div>
         
         <div class="exam-info">
-            <p><strong>学校名：</strong> {self.data.get('学校名', '')}</p>
-            <p><strong>科目：</strong> {self.data.get('科目', '')}</p>
-            <p><strong>試験時間：</strong> {self.data.get('試験時間', '')}分</p>
+            <p><strong>学校名：</strong> {doc.school}</p>
+            <p><strong>科目：</strong> {doc.subject}</p>
+            <p><strong>試験時間：</strong> {doc.duration}分</p>
         </div>
 
         <div class="exam-notes" style="{notes_style}">
@@ -185,32 +239,44 @@ class ExamGenerator:
     </div>"""
 
     def _create_problems(self):
-        html = ""
-        questions = self.data.get('大問', [])
+        return ''.join(self._iter_problems())
+
+    def _iter_problems(self, skip=frozenset()):
+        """大問ごとのHTML（skip に含まれる位置は None）"""
+        for i, section in enumerate(self.document.sections):
+            if i in skip:
+                yield None
+                continue
+            # 大問ごとに部分木のハッシュで断片をキャッシュ（編集した大問だけ再生成）
+            key = f"exam-problem:{section.digest}"
+            yield fragment_cache.get_or_render(key, lambda: self._render_problem(section)).value
+
+    def _render_problem(self, section):
+        parts = [self._problem_open(section)]
+        for item in section.items:
+            parts.append(self._problem_item(item, item.number, self._sub_body_html(item)))
+        parts.append(self._problem_close())
+        return ''.join(parts)
+
+    def _problem_open(self, section):
+        # 改ページチェック（大問の前）
+        qb_style = ""
+        if section.page_break:
+            qb_style = ' style="page-break-before: always; break-before: page;"'
+        
+        # 区分（必答/選択/なし）
+        q_type = section.kind
+        type_html = f'<span class="problem-type">{q_type}</span>' if q_type and q_type != '記載なし' else ''
         
-        for q in questions:
-            # 改ページチェック（大問の前）
-            qb_style = ""
-            if q.get('改ページ', False):
-                qb_style = ' style="page-break-before: always; break-before: page;"'
-            
-            # 区分（必答/選択/なし）
-            q_type = ""
-            if q.get('必須'):
-                q_type = "必答"
-            elif q.get('区分'):
-                q_type = q.get('区分')
-            type_html = f'<span class="problem-type">{q_type}</span>' if q_type and q_type != '記載なし' else ''
-            
-            # 配点
-            score = q.get('配点')
-            score_html = f'<span class="problem-score">（配点 {score}点）</span>' if score else ''
-            
-            # 大問タイトル
-            title = q.get('タイトル', q.get('番号', ''))
-            number = q.get('番号', '')
-
-            html += f"""
+        # 配点
+        score = section.score
+        score_html = f'<span class="problem-score">（配点 {score}点）</span>' if score else ''
+        
+        # 大問タイトル
+        title = section.title
+        number = section.number
+
+        return f"""
     <div class="problem-page"{qb_style}>
         <div class="problem-header">
             <div>
@@ -220,67 +286,75 @@ class ExamGenerator:
             {score_html}
         </div>
         <div class="problem-content">"""
-            
-            # 小問
-            sub_problems = q.get('小問', q.get('問題', []))
-            for sub in sub_problems:
-                sb_style = ""
-                if isinstance(sub, dict):
-                    # 改ページチェック（小問の前）
-                    if sub.get('改ページ', False):
-                        sb_style = ' style="page-break-before: always; break-before: page;"'
-                    body = sub.get('本文', '')
-                    num = sub.get('番号', '')
-                else:
-                    body = sub
-                    num = ''
-                
-                body_html = markdown.markdown(str(body))
-                html += f"""
+
+    def _problem_close(self):
+        return """
+        </div>
+    </div>"""
+
+    def _sub_body_html(self, item, choice_order=None):
+        """小問本文のHTML（選択肢があれば choice_order の順に並べる）"""
+        body_html = render_markdown(item.body)
+        if item.choices:
+            body_html += choices_html(item.choices, choice_order)
+        return body_html
+
+    def _problem_item(self, item, num, body_html):
+        # 改ページチェック（小問の前）
+        sb_style = ""
+        if item.page_break:
+            sb_style = ' style="page-break-before: always; break-before: page;"'
+        return f"""
             <div class="problem-item"{sb_style}>
                 <div class="problem-item-num">{num}</div>
                 <div class="problem-item-body">{body_html}</div>
             </div>"""
-            
-            html += """
-        </div>
-    </div>"""
-        
-        return html
 
     def _create_answers(self):
-        html = """
+        return self._create_answers_head() + ''.join(self._iter_answers()) + '</div>'
+
+    def _create_answers_head(self):
+        return """
     <div class="answer-page">
         <h2>解答・解説</h2>"""
-        
-        questions = self.data.get('大問', [])
-        for q in questions:
-            title = q.get('タイトル', q.get('番号', ''))
-            number = q.get('番号', '')
-            html += f"<h3>{number}. {title}</h3>"
-            
-            sub_problems = q.get('小問', q.get('問題', []))
-            for sub in sub_problems:
-                if isinstance(sub, dict):
-                    num = sub.get('番号', '')
-                    ans = sub.get('解答', '（解答なし）')
-                    exp = sub.get('解説', '')
-                else:
-                    continue
-                
-                exp_html = f'<div class="answer-explanation"><strong>【解説】</strong><br>{markdown.markdown(str(exp))}</div>' if exp else ''
-                
-                html += f"""
+
+    def _iter_answers(self, skip=frozenset()):
+        for i, section in enumerate(self.document.sections):
+            if i in skip:
+                yield None
+                continue
+            key = f"exam-answer:{section.digest}"
+            yield fragment_cache.get_or_render(key, lambda: self._render_answer(section)).value
+
+    def _render_answer(self, section):
+        parts = [self._answer_title(section)]
+        for item in section.items:
+            if not item.plain:
+                parts.append(self._answer_item(item.number, item.answer, self._explanation_html(item)))
+        return ''.join(parts)
+
+    def _answer_title(self, section):
+        return f"<h3>{section.number}. {section.title}</h3>"
+
+    def _explanation_html(self, item):
+        exp = item.explanation
+        return f'<div class="answer-explanation"><strong>【解説】</strong><br>{render_markdown(exp)}</div>' if exp else ''
+
+    def _answer_item(self, num, ans, exp_html):
+        return f"""
             <div class="answer-item">
                 <div><strong>{num}</strong> <span class="answer-correct">{ans}</span></div>
                 {exp_html}
             </div>"""
-            
-        html += "</div>"
-        return html
 
 
-def generate_exam_html(yaml_content: str) -> str:
+def generate_exam_html(yaml_content: str, stylesheet_url: str | None = None, mathjax_url: str | None = None) -> str:
     """YAML文字列からHTML文字列を生成"""
-    generator = ExamGenerator(yaml_content)
+    generator = ExamGenerator(yaml_content, stylesheet_url, mathjax_url)
     return generator.generate_html()
+
+
+def iter_exam_html(yaml_content: str, stylesheet_url: str | None = None, mathjax_url: str | None = None):
+    """YAML文字列からHTMLを断片ごとに生成（YAMLの解析はこの時点で行う）"""
+    generator = ExamGenerator(yaml_content, stylesheet_url, mathjax_url)
+    return generator.iter_html()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+テストの並べ替え版（A版・B版…）の生成
+大問ごとに小問の順序（と、指定があれば選択肢の順序）をシードに基づいて入れ替え、
+版ごとの解答一覧を作る。小問本文・解説のHTMLは最初に一度だけ生成し、
+版ごとには並べ替えて連結するだけにする
+"""
+
+import random
+import re
+
+from exam_generator import ExamGenerator, choice_label, choices_html
+from markdown_engine import render_markdown
+
+
+def variant_label(index: int) -> str:
+    """版の名前（A, B, … Z, 27, 28, …）"""
+    return chr(ord('A') + index) if index < 26 else str(index + 1)
+
+
+# 複数の記号を並べた解答の区切り（「ア、ウ」「ア,ウ」「ア・ウ」「ア ウ」など）
+_ANSWER_SEPARATOR = re.compile(r'(\s*[、,，・/／]\s*|\s+)')
+
+
+def _remap_one(text: str, labels: list[str], texts: list[str], order: list[int]) -> str | None:
+    """記号1つ（または選択肢の文言）を並べ替え後の記号にする。該当しなければ None"""
+    if text in labels:
+        original = labels.index(text)
+    elif text in texts:
+        original = texts.index(text)
+    else:
+        return None
+    return choice_label(order.index(original))
+
+
+def remap_choice_answer(answer, choices: list, order: list[int] | None):
+    """選択肢を並べ替えたときの解答（記号または選択肢の文言で書かれていれば新しい記号にする）。
+    リストの解答や「ア、ウ」のような複数の記号は、それぞれを置き換える"""
+    if order is None or not choices:
+        return answer
+    labels = [choice_label(i) for i in range(len(choices))]
+    texts = [str(c) for c in choices]
+    if isinstance(answer, list):
+        return [remap_choice_answer(a, choices, order) for a in answer]
+    text = str(answer).strip()
+    single = _remap_one(text, labels, texts, order)
+    if single is not None:
+        return single
+    parts = _ANSWER_SEPARATOR.split(text)
+    tokens = parts[0::2]
+    if len(tokens) < 2:
+        return answer
+    remapped = [_remap_one(token, labels, texts, order) for token in tokens]
+    if None in remapped:
+        return answer
+    parts[0::2] = remapped
+    return ''.join(parts)
+
+
+class ExamVariantGenerator(ExamGenerator):
+    """小問を並べ替えた版を作るテスト生成"""
+
+    def __init__(self, yaml_content: str, stylesheet_url: str | None = None, mathjax_url: str | None = None,
+                 shuffle_choices: bool = False):
+        super().__init__(yaml_content, stylesheet_url, mathjax_url)
+        self.shuffle_choices = shuffle_choices
+        self._sections = [self._prepare_section(section) for section in self.document.sections]
+        self._plan = None  # 大問ごとの [(元の小問の位置, 選択肢の並び or None), ...]
+        self._label = ''
+        self._head = None
+
+    def _prepare_section(self, section) -> dict:
+        subs = []
+        for item in section.items:
+            subs.append({
+                'item': item,
+                'num': item.number,
+                'body': render_markdown(item.body),
+                'choices': item.choices,
+                'answer': item.answer,
+                'explanation': '' if item.plain else self._explanation_html(item),
+            })
+        return {
+            'number': section.number,
+            'title': section.title,
+            'open': self._problem_open(section),
+            'answer_title': self._answer_title(section),
+            'subs': subs,
+        }
+
+    def variant_plan(self, index: int, seed=0) -> list[list[tuple[int, list[int] | None]]]:
+        """index 番目の版の並び（同じ seed と index なら常に同じ）"""
+        rng = random.Random(f'{seed}:{index}')
+        plan = []
+        for section in self._sections:
+            subs = section['subs']
+            # 文字列だけの小問（「次の問いに答えよ。」など）はその位置に固定し、番号のある小問だけを入れ替える
+            order = [i for i, sub in enumerate(subs) if not sub['item'].plain]
+            rng.shuffle(order)
+            shuffled = iter(order)
+            placement = []
+            for position, sub in enumerate(subs):
+                i = position if sub['item'].plain else next(shuffled)
+                choices = subs[i]['choices']
+                choice_order = None
+                if self.shuffle_choices and choices:
+                    choice_order = list(range(len(choices)))
+                    rng.shuffle(choice_order)
+                placement.append((i, choice_order))
+            plan.append(placement)
+        return plan
+
+    def generate_variant(self, index: int, seed=0) -> dict:
+        """1つの版の HTML と解答一覧"""
+        plan = self.variant_plan(index, seed)
+        self._plan, self._label = plan, variant_label(index)
+        try:
+            html = self.generate_html()
+        finally:
+            self._plan, self._label = None, ''
+        return {
+            'label': variant_label(index),
+            'seed': seed,
+            'index': index,
+            'html': html,
+            'answer_key': self._answer_key(plan),
+        }
+
+    def generate_variants(self, count: int, seed=0) -> list[dict]:
+        return [self.generate_variant(i, seed) for i in range(count)]
+
+    def _answer_key(self, plan) -> list[dict]:
+        key = []
+        for section, placement in zip(self._sections, plan):
+            subs = section['subs']
+            items = []
+            for position, (i, choice_order) in enumerate(placement):
+                sub = subs[i]
+                if sub['answer'] is None:
+                    continue
+                items.append({
+                    '番号': subs[position]['num'],
+                    '元の番号': sub['num'],
+                    '解答': remap_choice_answer(sub['answer'], sub['choices'], choice_order),
+                })
+            key.append({'番号': section['number'], 'タイトル': section['title'], '小問': items})
+        return key
+
+    # ---------- 版ごとに差し替える部分 ----------
+
+    def _create_head(self):
+        if self._head is None:
+            self._head = super()._create_head()
+        return self._head
+
+    def _cover_subtitle(self):
+        subtitle = super()._cover_subtitle()
+        if not self._label:
+            return subtitle
+        return f'{subtitle}（{self._label}版）' if subtitle else f'{self._label}版'
+
+    def _iter_problems(self, skip=frozenset()):
+        if self._plan is None:
+            yield from super()._iter_problems(skip)
+            return
+        close = self._problem_close()
+        for section, placement in zip(self._sections, self._plan):
+            subs = section['subs']
+            parts = [section['open']]
+            for position, (i, choice_order) in enumerate(placement):
+                sub = subs[i]
+                body = sub['body']
+                if sub['choices']:
+                    body += choices_html(sub['choices'], choice_order)
+                # 番号と改ページは位置に対応させる（(1), (2), … の並びと改ページ位置は版によらず同じ）
+                parts.append(self._problem_item(subs[position]['item'], subs[position]['num'], body))
+            parts.append(close)
+            yield ''.join(parts)
+
+    def _iter_answers(self, skip=frozenset()):
+        if self._plan is None:
+            yield from super()._iter_answers(skip)
+            return
+        for section, placement in zip(self._sections, self._plan):
+            subs = section['subs']
+            parts = [section['answer_title']]
+            for position, (i, choice_order) in enumerate(placement):
+                sub = subs[i]
+                if sub['answer'] is None:
+                    continue
+                answer = remap_choice_answer(sub['answer'], sub['choices'], choice_order)
+                parts.append(self._answer_item(subs[position]['num'], answer, sub['explanation']))
+            yield ''.join(parts)
+
+
+def generate_exam_variants(yaml_content: str, count: int, seed=0, shuffle_choices: bool = False,
+                           stylesheet_url: str | None = None, mathjax_url: str | None = None) -> list[dict]:
+    """YAML文字列から count 個の並べ替え版を生成"""
+    generator = ExamVariantGenerator(yaml_content, stylesheet_url, mathjax_url, shuffle_choices)
+    return generator.generate_variants(count, seed)
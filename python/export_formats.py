@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+複数形式の同時出力
+1回の解析と1回の断片生成から、要求された形式（HTML・解答のみ・問題のみ・DOCX）を
+まとめて作る。HTML系の形式は iter_fragments の断片を選んで連結するだけなので、
+形式を増やしても生成の手間はほとんど増えない
+"""
+
+import base64
+import json
+
+from preview import GENERATORS
+
+# 文書種別 → 出力できる形式
+EXPORT_FORMATS = {
+    'exam': ('html', 'problems', 'answer-key'),
+    'worksheet': ('html', 'problems', 'answer-key'),
+    'lesson-plan': ('html', 'docx'),
+}
+
+# HTMLとして返す形式（最小化の対象）
+HTML_FORMATS = ('html', 'problems', 'answer-key')
+
+# 解答部分の断片ID（answer-<大問・問題のハッシュ> も含む）
+_ANSWER_FRAGMENTS = ('answers-head', 'answers-tail')
+# 解答部分の先頭に入る改ページ（解答のみの文書では不要）
+_PAGE_BREAK = '<div class="page-break"></div>'
+
+
+def _is_answer(fragment_id: str) -> bool:
+    return fragment_id in _ANSWER_FRAGMENTS or fragment_id.startswith('answer-')
+
+
+def validate_formats(doctype: str, formats) -> list[str]:
+    """重複を除いた形式のリスト（未対応の形式は ValueError）"""
+    supported = EXPORT_FORMATS[doctype]
+    unknown = [f for f in formats if f not in supported]
+    if unknown:
+        raise ValueError(f"unsupported format for {doctype}: {', '.join(unknown)} (supported: {', '.join(supported)})")
+    if not formats:
+        raise ValueError('formats must not be empty')
+    return list(dict.fromkeys(formats))
+
+
+def render_formats(yaml_content: str, doctype: str, formats, stylesheet_url: str | None = None,
+                   mathjax_url: str | None = None) -> dict[str, str]:
+    """形式 → 出力 の辞書を返す（DOCXはBase64）。ワーカー内で呼ぶ"""
+    formats = validate_formats(doctype, formats)
+    generator = GENERATORS[doctype](yaml_content, stylesheet_url, mathjax_url)
+    fragments = list(generator.iter_fragments()) if any(f in HTML_FORMATS for f in formats) else []
+    outputs = {}
+    for fmt in formats:
+        if fmt == 'html':
+            outputs[fmt] = ''.join(html for _, html in fragments)
+        elif fmt == 'problems':
+            outputs[fmt] = ''.join(html for fragment_id, html in fragments if not _is_answer(fragment_id))
+        elif fmt == 'answer-key':
+            parts = []
+            for fragment_id, html in fragments:
+                if fragment_id == 'answers-head':
+                    html = html.replace(_PAGE_BREAK, '', 1)
+                if fragment_id in ('head', 'tail') or _is_answer(fragment_id):
+                    parts.append(html)
+            outputs[fmt] = ''.join(parts)
+        elif fmt == 'docx':
+            outputs[fmt] = base64.b64encode(generator.generate_docx_bytes()).decode('utf-8')
+    return outputs
+
+
+def render_formats_json(yaml_content: str, doctype: str, formats, stylesheet_url: str | None = None,
+                        mathjax_url: str | None = None) -> str:
+    """render_formats の結果をJSON文字列で返す（生成結果キャッシュに文字列として保持するため）"""
+    return json.dumps(render_formats(yaml_content, doctype, formats, stylesheet_url, mathjax_url), ensure_ascii=False)
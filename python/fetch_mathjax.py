@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MathJax バンドルの取得
+npm レジストリから固定バージョン（mathjax.MATHJAX_VERSION）の tarball を取得し、
+es5 ディレクトリの中身を KYOZAI_MATHJAX_DIR（既定: python/vendor/mathjax）に展開する
+
+使い方: python fetch_mathjax.py
+"""
+
+import io
+import os
+import shutil
+import sys
+import tarfile
+import urllib.request
+
+from mathjax import MATHJAX_DIR, MATHJAX_VERSION, VERSION_FILE, local_bundle_available
+
+TARBALL_URL = f'https://registry.npmjs.org/mathjax/-/mathjax-{MATHJAX_VERSION}.tgz'
+PREFIX = 'package/es5/'
+
+
+def fetch(target: str = MATHJAX_DIR):
+    with urllib.request.urlopen(TARBALL_URL, timeout=60) as response:
+        data = response.read()
+
+    staging = target + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as tar:
+        for member in tar.getmembers():
+            if not member.isfile() or not member.name.startswith(PREFIX):
+                continue
+            relative = member.name[len(PREFIX):]
+            path = os.path.join(staging, relative)
+            if not os.path.realpath(path).startswith(os.path.realpath(staging) + os.sep):
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with tar.extractfile(member) as src, open(path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+    with open(os.path.join(staging, VERSION_FILE), 'w', encoding='utf-8') as f:
+        f.write(MATHJAX_VERSION + '\n')
+
+    # 展開が終わってから差し替える（途中で失敗しても既存のバンドルは残る）
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(staging, target)
+
+
+if __name__ == '__main__':
+    if local_bundle_available() and '--force' not in sys.argv:
+        print(f'MathJax {MATHJAX_VERSION} は取得済みです: {MATHJAX_DIR}')
+        sys.exit(0)
+    print(f'取得中: {TARBALL_URL}')
+    fetch()
+    print(f'展開しました: {MATHJAX_DIR}')
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共有Markdownレンダリングサービス
+Markdown インスタンスをプールして reset() で再利用し、変換結果をLRUで保持する
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import markdown
+
+from metrics import markdown_seconds, record_phase
+
+
+class MarkdownEngine:
+    """スレッドセーフなMarkdown変換（インスタンスプール + 変換結果キャッシュ）"""
+
+    def __init__(self, max_entries: int = 4096, **markdown_options):
+        self.max_entries = max_entries
+        self._options = markdown_options
+        self._pool: list[markdown.Markdown] = []
+        self._pool_lock = threading.Lock()
+        self._cache: OrderedDict[str, str] = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.calls = 0
+        self.cache_hits = 0
+        self.conversions = 0
+        self.instances_created = 0
+
+    def _acquire(self) -> markdown.Markdown:
+        with self._pool_lock:
+            if self._pool:
+                return self._pool.pop()
+            self.instances_created += 1
+        return markdown.Markdown(**self._options)
+
+    def _release(self, md: markdown.Markdown):
+        md.reset()
+        with self._pool_lock:
+            self._pool.append(md)
+
+    def convert(self, source: str) -> str:
+        """Markdown文字列をHTMLに変換（同一文字列はキャッシュから返す）"""
+        start = time.perf_counter()
+        try:
+            return self._convert(source)
+        finally:
+            elapsed = time.perf_counter() - start
+            markdown_seconds.observe(elapsed)
+            record_phase('markdown', elapsed)
+
+    def _convert(self, source: str) -> str:
+        with self._cache_lock:
+            self.calls += 1
+            html = self._cache.get(source)
+            if html is not None:
+                self._cache.move_to_end(source)
+                self.cache_hits += 1
+                return html
+
+        md = self._acquire()
+        try:
+            html = md.convert(source)
+        finally:
+            self._release(md)
+
+        with self._cache_lock:
+            self.conversions += 1
+            self._cache[source] = html
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return html
+
+    def clear(self):
+        with self._cache_lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        with self._cache_lock:
+            return {
+                'calls': self.calls,
+                'cache_hits': self.cache_hits,
+                'conversions': self.conversions,
+                'cached_entries': len(self._cache),
+                'pooled_instances': len(self._pool),
+                'instances_created': self.instances_created,
+            }
+
+
+markdown_engine = MarkdownEngine(int(os.environ.get('KYOZAI_MARKDOWN_CACHE_SIZE', 4096)))
+
+
+def render_markdown(source) -> str:
+    """共有エンジンでMarkdownをHTMLに変換"""
+    return markdown_engine.convert(str(source))
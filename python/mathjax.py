@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MathJax の読み込み設定
+固定バージョンのバンドルをローカルに置いてサーバーから配信し、
+数式を含まない文書ではスクリプト自体を出力しない
+"""
+
+import os
+
+# fetch_mathjax.py で取得するバージョン（URLに含めるため、内容が変わればURLも変わる）
+MATHJAX_VERSION = '3.2.2'
+MATHJAX_ENTRY = 'tex-mml-chtml.js'
+CDN_URL = f'https://cdn.jsdelivr.net/npm/mathjax@3/es5/{MATHJAX_ENTRY}'
+
+# es5 ディレクトリの中身（tex-mml-chtml.js, output/... など）を置く場所
+MATHJAX_DIR = os.environ.get(
+    'KYOZAI_MATHJAX_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vendor', 'mathjax'),
+)
+VERSION_FILE = 'mathjax-version.txt'
+
+# サーバーを介さない生成（一括生成・CLI）で使うURL
+DEFAULT_URL = os.environ.get('KYOZAI_MATHJAX_URL', CDN_URL)
+
+# 数式の区切り（$...$, $$...$$ と MathJax 既定の \(...\), \[...\]）
+_MATH_MARKERS = ('$', '\\(', '\\[')
+
+
+def has_math(text: str) -> bool:
+    """文書に数式の区切り記号が含まれているか"""
+    return any(marker in text for marker in _MATH_MARKERS)
+
+
+def local_bundle_available() -> bool:
+    """MATHJAX_DIR に固定バージョンのバンドルが置かれているか"""
+    try:
+        with open(os.path.join(MATHJAX_DIR, VERSION_FILE), encoding='utf-8') as f:
+            version = f.read().strip()
+    except OSError:
+        return False
+    return version == MATHJAX_VERSION and os.path.isfile(os.path.join(MATHJAX_DIR, MATHJAX_ENTRY))
+
+
+def local_path(path: str) -> str | None:
+    """配信するファイルの絶対パス（MATHJAX_DIR の外や存在しないファイルなら None）"""
+    root = os.path.realpath(MATHJAX_DIR)
+    full = os.path.realpath(os.path.join(root, path))
+    if not full.startswith(root + os.sep) or not os.path.isfile(full):
+        return None
+    return full
+
+
+def script_tag(url: str | None = None) -> str:
+    """<head> 内に置く MathJax 読み込みタグ"""
+    return f'    <script id="MathJax-script" async src="{url or DEFAULT_URL}"></script>'
+
+
+# $...$ をインライン数式として扱う設定（テスト・プリント用）
+TEX_CONFIG = """    <script>
+        MathJax = {
+            tex: {
+                inlineMath: [['$', '$']],
+                displayMath: [['$$', '$$']],
+                processEscapes: true
+            }
+        };
+    </script>"""
+
+
+def head_scripts(url: str | None = None, tex_config: bool = True) -> str:
+    """<head> 内に置く MathJax の読み込みと設定（末尾の改行を含む）"""
+    if tex_config:
+        return f'{script_tag(url)}\n{TEX_CONFIG}\n'
+    return f'{script_tag(url)}\n'
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+メトリクス
+リクエスト数・エラー数・レイテンシと、生成処理のフェーズ別所要時間を集計し、
+Prometheus のテキスト形式で出力する（外部ライブラリは使用しない）
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(8))  # 1KiB 〜 16MiB
+
+# 子プロセスのワーカーでは観測値をここに溜め、親プロセスへ送って記録する（call_capturing が設定する）
+metric_capture: ContextVar[list | None] = ContextVar('metric_capture', default=None)
+
+
+def _format_labels(names, values, extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        captured = metric_capture.get()
+        if captured is not None:
+            captured.append((self.name, amount, labels))
+            return
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def expose(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # ラベル値 → [各バケットの件数..., 合計値, 件数]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        captured = metric_capture.get()
+        if captured is not None:
+            captured.append((self.name, value, labels))
+            return
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def expose(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state):
+                    cumulative += count
+                    le = f'le="{_format_value(float(bound))}"'
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+                inf = 'le="+Inf"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, inf)} {state[-1]}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-2])}')
+                lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._by_name = {}
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        self._by_name[metric.name] = metric
+        return metric
+
+    def replay(self, records):
+        """call_capturing で子プロセスから持ち帰った観測値を記録する"""
+        for name, value, labels in records:
+            metric = self._by_name[name]
+            if isinstance(metric, Counter):
+                metric.inc(value, **labels)
+            else:
+                metric.observe(value, **labels)
+
+    def expose(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    'kyozai_http_requests_total', 'HTTPリクエスト数', ('endpoint', 'method', 'status')))
+http_latency = registry.register(Histogram(
+    'kyozai_http_request_duration_seconds', 'HTTPリクエストの処理時間', ('endpoint', 'method')))
+render_errors = registry.register(Counter(
+    'kyozai_render_errors_total', '生成に失敗した件数', ('endpoint',)))
+input_size = registry.register(Histogram(
+    'kyozai_input_bytes', '入力YAMLのサイズ', ('endpoint',), SIZE_BUCKETS))
+output_size = registry.register(Histogram(
+    'kyozai_output_bytes', '生成結果のサイズ', ('endpoint',), SIZE_BUCKETS))
+render_phase = registry.register(Histogram(
+    'kyozai_render_phase_seconds',
+    '生成処理のフェーズ別所要時間（html_assembly は markdown を含む）',
+    ('generator', 'phase')))
+markdown_seconds = registry.register(Histogram(
+    'kyozai_markdown_convert_seconds', 'Markdown変換1回あたりの所要時間（キャッシュ命中を含む）'))
+preview_fragments = registry.register(Counter(
+    'kyozai_preview_fragments_total', 'ライブプレビューで送信した/送信を省いた断片数', ('doctype', 'result')))
+render_coalesced = registry.register(Counter(
+    'kyozai_render_coalesced_total', '生成中の同一リクエストの結果を共有して省いた生成の回数', ('endpoint',)))
+
+
+# リクエスト単位でフェーズ別の所要時間を集める辞書（profiling.collect_phases が設定する）
+phase_collector: ContextVar[dict | None] = ContextVar('phase_collector', default=None)
+
+
+def record_phase(name: str, elapsed: float):
+    collector = phase_collector.get()
+    if collector is not None:
+        collector[name] = collector.get(name, 0.0) + elapsed
+
+
+def call_capturing(func, *args):
+    """func(*args) を実行し (結果, 記録せずに溜めた観測値) を返す。
+    プロセスプールのワーカーで使い、親プロセスで registry.replay() に渡す"""
+    records = []
+    token = metric_capture.set(records)
+    try:
+        return func(*args), records
+    finally:
+        metric_capture.reset(token)
+
+
+@contextmanager
+def phase(generator: str, name: str):
+    """with ブロックの所要時間をフェーズ別ヒストグラムに記録"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        render_phase.observe(elapsed, generator=generator, phase=name)
+        record_phase(name, elapsed)
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文書モデル
+解析済みYAMLを、別名（小問/問題、展開/授業展開、評価/本時の評価 など）を解決した
+__slots__ クラスに一度だけ変換する。構造の誤りは生成を始める前に、
+場所を示した DocumentValidationError として報告する。
+表示に使う値（タイトル・本文・配点など）はYAMLの値をそのまま保持する
+"""
+
+import os
+
+from render_cache import subtree_hash
+from yaml_loader import ParsedDocumentCache, load_yaml
+
+
+class DocumentValidationError(ValueError):
+    """文書の構造がモデルに合わない（path は誤りの場所。例: 大問[2].小問）"""
+
+    def __init__(self, path: str, message: str):
+        self.path = path
+        self.message = message
+        super().__init__(f'{path}: {message}' if path else message)
+
+    def __reduce__(self):
+        # ワーカープロセスから送り返せるように（既定の pickle は引数1つで作り直そうとする）
+        return type(self), (self.path, self.message)
+
+
+def _join(path: str, key) -> str:
+    if isinstance(key, int):
+        return f'{path}[{key}]'
+    return f'{path}.{key}' if path else str(key)
+
+
+def _mapping(value, path: str) -> dict:
+    if not isinstance(value, dict):
+        raise DocumentValidationError(path, f'キーと値の組（マッピング）である必要があります（{type(value).__name__}）')
+    return value
+
+
+def _list(value, path: str) -> list:
+    """リストを返す（未指定・null は空リスト、単独の値は1要素のリスト）"""
+    if value is None:
+        return []
+    if isinstance(value, dict):
+        raise DocumentValidationError(path, 'リストである必要があります（マッピングが指定されています）')
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def _first_key(data: dict, path: str, *keys):
+    """最初に存在するキーの (キーのパス, 値)。どれもなければ (最初のキーのパス, None)"""
+    for key in keys:
+        if key in data:
+            return _join(path, key), data[key]
+    return _join(path, keys[0]), None
+
+
+# ========== テスト ==========
+
+class ExamItem:
+    """小問"""
+    __slots__ = ('number', 'body', 'answer', 'explanation', 'choices', 'page_break', 'plain')
+
+    def __init__(self, number, body, answer, explanation, choices, page_break, plain):
+        self.number = number
+        self.body = body
+        self.answer = answer
+        self.explanation = explanation
+        self.choices = choices
+        self.page_break = page_break
+        self.plain = plain  # 文字列だけの小問（番号・解答なし）
+
+    @classmethod
+    def parse(cls, value, path: str) -> 'ExamItem':
+        if not isinstance(value, dict):
+            return cls('', value, None, '', [], False, True)
+        return cls(
+            value.get('番号', ''),
+            value.get('本文', ''),
+            value.get('解答', '（解答なし）'),
+            value.get('解説', ''),
+            _list(value.get('選択肢'), _join(path, '選択肢')),
+            bool(value.get('改ページ', False)),
+            False,
+        )
+
+
+class ExamSection:
+    """大問"""
+    __slots__ = ('number', 'title', 'kind', 'score', 'page_break', 'items', 'digest')
+
+    def __init__(self, number, title, kind, score, page_break, items, digest):
+        self.number = number
+        self.title = title
+        self.kind = kind  # 必答 / 区分の値 / ''
+        self.score = score
+        self.page_break = page_break
+        self.items = items
+        self.digest = digest  # 断片キャッシュのキー（大問の部分木のハッシュ）
+
+    @classmethod
+    def parse(cls, value, path: str) -> 'ExamSection':
+        q = _mapping(value, path)
+        items_path, items = _first_key(q, path, '小問', '問題')
+        kind = '必答' if q.get('必須') else (q.get('区分') or '')
+        return cls(
+            q.get('番号', ''),
+            q.get('タイトル', q.get('番号', '')),
+            kind,
+            q.get('配点'),
+            bool(q.get('改ページ', False)),
+            [ExamItem.parse(sub, _join(items_path, i)) for i, sub in enumerate(_list(items, items_path))],
+            subtree_hash(q),
+        )
+
+
+class ExamDocument:
+    __slots__ = ('title', 'subtitle', 'school', 'subject', 'duration', 'notes', 'sections')
+
+    def __init__(self, title, subtitle, school, subject, duration, notes, sections):
+        self.title = title  # タイトル / 試験名（どちらもなければ None）
+        self.subtitle = subtitle
+        self.school = school
+        self.subject = subject
+        self.duration = duration
+        self.notes = notes
+        self.sections = sections
+
+    @classmethod
+    def parse(cls, data) -> 'ExamDocument':
+        d = _mapping(data, '')
+        _, title = _first_key(d, '', 'タイトル', '試験名')
+        return cls(
+            title,
+            d.get('サブタイトル', ''),
+            d.get('学校名', ''),
+            d.get('科目', ''),
+            d.get('試験時間', ''),
+            _list(d.get('注意事項'), '注意事項'),
+            [ExamSection.parse(q, _join('大問', i)) for i, q in enumerate(_list(d.get('大問'), '大問'))],
+        )
+
+
+# ========== プリント ==========
+
+class WorksheetHeader:
+    """問題の間に置く見出し（type: header）"""
+    __slots__ = ('text', 'page_break', 'digest')
+
+    def __init__(self, text, page_break, digest):
+        self.text = text
+        self.page_break = page_break
+        self.digest = digest
+
+
+class WorksheetProblem:
+    __slots__ = ('number', 'body', 'score', 'subs', 'spaces', 'answers', 'explanation', 'page_break', 'digest')
+
+    def __init__(self, number, body, score, subs, spaces, answers, explanation, page_break, digest):
+        self.number = number
+        self.body = body
+        self.score = score
+        self.subs = subs  # [(番号 または None, 本文)]（None は文字列だけの小問）
+        self.spaces = spaces
+        self.answers = answers
+        self.explanation = explanation
+        self.page_break = page_break
+        self.digest = digest
+
+
+class WorksheetDocument:
+    __slots__ = ('title', 'subtitle', 'make_answers', 'problems')
+
+    def __init__(self, title, subtitle, make_answers, problems):
+        self.title = title  # 未指定なら None
+        self.subtitle = subtitle
+        self.make_answers = make_answers
+        self.problems = problems  # WorksheetProblem / WorksheetHeader
+
+    @staticmethod
+    def parse_problem(value, i: int):
+        """問題リストの i 番目の要素（番号の既定値は i + 1）"""
+        path = _join('問題', i)
+        prob = _mapping(value, path)
+        if prob.get('type') == 'header':
+            return WorksheetHeader(prob.get('text', ''), bool(prob.get('改ページ', False)), subtree_hash(prob))
+        subs = []
+        for sub in _list(prob.get('小問'), _join(path, '小問')):
+            if isinstance(sub, str):
+                subs.append((None, sub))
+            elif isinstance(sub, dict):
+                subs.append((sub.get('番号', ''), sub.get('本文', '')))
+        return WorksheetProblem(
+            prob.get('番号', i + 1),
+            prob.get('本文', ''),
+            prob.get('配点'),
+            subs,
+            prob.get('スペース', 5),
+            prob.get('解答', []),
+            prob.get('解説', ''),
+            bool(prob.get('改ページ', False)),
+            subtree_hash(prob),
+        )
+
+    @classmethod
+    def parse(cls, data) -> 'WorksheetDocument':
+        d = _mapping(data, '')
+        problems = _list(d.get('問題'), '問題')
+        return cls(
+            d.get('タイトル'),
+            d.get('サブタイトル', ''),
+            bool(d.get('解答を作成', True)),
+            [cls.parse_problem(p, i) for i, p in enumerate(problems)],
+        )
+
+
+# ========== 指導案 ==========
+
+class LessonPhase:
+    """展開の1段階（導入・展開・まとめ など）"""
+    __slots__ = ('name', 'minutes', 'contents', 'activities', 'notes')
+
+    def __init__(self, name, minutes, contents, activities, notes):
+        self.name = name
+        self.minutes = minutes
+        self.contents = contents
+        self.activities = activities
+        self.notes = notes
+
+    @classmethod
+    def parse(cls, name, value, path: str) -> 'LessonPhase':
+        phase = _mapping(value, path)
+        return cls(
+            name,
+            phase.get('時間', ''),
+            [c for c in _list(phase.get('学習内容'), _join(path, '学習内容')) if c],
+            [a for a in _list(phase.get('学習活動'), _join(path, '学習活動')) if a],
+            [n for n in _list(phase.get('留意点'), _join(path, '留意点')) if n],
+        )
+
+
+class LessonPlanDocument:
+    __slots__ = ('subject', 'date', 'school', 'target', 'venue', 'teacher', 'unit', 'textbook',
+                 'goals', 'flow', 'flow_length', 'evaluations')
+
+    def __init__(self, subject, date, school, target, venue, teacher, unit, textbook,
+                 goals, flow, flow_length, evaluations):
+        self.subject = subject
+        self.date = date
+        self.school = school
+        self.target = target
+        self.venue = venue
+        self.teacher = teacher
+        self.unit = unit
+        self.textbook = textbook
+        self.goals = goals
+        self.flow = flow  # 内容のある段階だけ
+        self.flow_length = flow_length  # 内容のない段階も含めた数（Wordの表の行数に使う）
+        self.evaluations = evaluations  # 評価規準の文言
+
+    @classmethod
+    def parse(cls, data) -> 'LessonPlanDocument':
+        d = _mapping(data, '')
+        goals = d.get('本時の目標') or d.get('目標')
+        flow_path, flow = _first_key(d, '', '展開', '授業展開')
+        flow = _mapping(flow, flow_path) if flow else {}
+        evaluations_path, evaluations = _first_key(d, '', '評価', '本時の評価')
+        return cls(
+            d.get('教科', ''),
+            d.get('日時', ''),
+            d.get('学校名', ''),
+            d.get('対象', ''),
+            d.get('会場', ''),
+            d.get('授業者', ''),
+            d.get('単元名', ''),
+            d.get('使用教科書', ''),
+            [g for g in _list(goals, '本時の目標') if g],
+            [LessonPhase.parse(name, phase, _join(flow_path, name)) for name, phase in flow.items() if phase],
+            len(flow),
+            [e.get('規準', e) if isinstance(e, dict) else e for e in _list(evaluations, evaluations_path) if e],
+        )
+
+
+# ========== 解析結果のキャッシュ ==========
+
+_CACHE_SIZE = int(os.environ.get('KYOZAI_MODEL_CACHE_SIZE', 64))
+
+document_caches = {
+    'exam': ParsedDocumentCache(_CACHE_SIZE, lambda text: ExamDocument.parse(load_yaml(text))),
+    'worksheet': ParsedDocumentCache(_CACHE_SIZE, lambda text: WorksheetDocument.parse(load_yaml(text))),
+    'lesson-plan': ParsedDocumentCache(_CACHE_SIZE, lambda text: LessonPlanDocument.parse(load_yaml(text))),
+}
+
+
+def load_exam(yaml_content: str) -> ExamDocument:
+    return document_caches['exam'].load(yaml_content)
+
+
+def load_worksheet(yaml_content: str) -> WorksheetDocument:
+    return document_caches['worksheet'].load(yaml_content)
+
+
+def load_lesson_plan(yaml_content: str) -> LessonPlanDocument:
+    return document_caches['lesson-plan'].load(yaml_content)
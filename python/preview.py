@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ライブプレビュー
+接続ごとに直前の断片（iter_fragments の ID → HTML）を保持し、
+内容が変わった断片だけをパッチとして送る。
+大問・問題の断片IDは内容のハッシュなので、接続が既に持っているIDの断片は生成もしない
+"""
+
+from exam_generator import ExamGenerator
+from worksheet_generator import WorksheetGenerator
+from lesson_plan_generator import LessonPlanGenerator
+import metrics
+
+# 文書種別 → ジェネレータクラス
+GENERATORS = {
+    "exam": ExamGenerator,
+    "worksheet": WorksheetGenerator,
+    "lesson-plan": LessonPlanGenerator,
+}
+
+
+def render_fragments(doctype: str, yaml_content: str, stylesheet_url: str | None = None,
+                     mathjax_url: str | None = None, known=frozenset()) -> list[tuple[str, str | None]]:
+    """文書を (断片ID, HTML) のリストとして生成（ワーカー内で呼ぶ）。
+    known に含まれるIDの大問・問題は生成せず、HTMLを None にする"""
+    generator = GENERATORS[doctype](yaml_content, stylesheet_url, mathjax_url)
+    return list(generator.iter_fragments(known))
+
+
+class PreviewSession:
+    """1接続分のプレビュー状態"""
+
+    def __init__(self, doctype: str):
+        self.doctype = doctype
+        self.revision = 0
+        self._fragments: dict[str, str] = {}
+        self._order: list[str] = []
+
+    def known(self) -> frozenset:
+        """前回送った断片ID（render_fragments に渡すと、これらの大問・問題の生成を省ける）"""
+        return frozenset(self._fragments)
+
+    def diff(self, fragments: list[tuple[str, str | None]]) -> dict | None:
+        """前回からの差分メッセージを作り、状態を更新する（変化がなければ None）。
+
+        初回は type=full で全断片を、以降は type=patch で変わった断片と消えた断片IDを返す。
+        断片の並び（order）は初回と、増減・入れ替えがあったときだけ含める。
+        HTMLが None の断片（known() で生成を省いたもの）は前回のHTMLのまま扱う
+        """
+        fragments = [
+            (fragment_id, self._fragments[fragment_id] if html is None else html)
+            for fragment_id, html in fragments
+        ]
+        order = [fragment_id for fragment_id, _ in fragments]
+        changed = [
+            {"id": fragment_id, "html": html}
+            for fragment_id, html in fragments
+            if self._fragments.get(fragment_id) != html
+        ]
+        current = set(order)
+        removed = [fragment_id for fragment_id in self._order if fragment_id not in current]
+        reordered = order != self._order
+        metrics.preview_fragments.inc(len(changed), doctype=self.doctype, result="sent")
+        metrics.preview_fragments.inc(len(fragments) - len(changed), doctype=self.doctype, result="unchanged")
+        if not changed and not reordered:
+            return None
+
+        first = self.revision == 0
+        self.revision += 1
+        self._fragments = dict(fragments)
+        self._order = order
+        message = {
+            "type": "full" if first else "patch",
+            "revision": self.revision,
+            "changed": changed,
+            "removed": removed,
+        }
+        if first or reordered:
+            message["order"] = order
+        return message
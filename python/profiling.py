@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+生成処理のプロファイリング
+個別リクエストを cProfile / tracemalloc の下で実行して上位の関数・割り当て箇所を集計し、
+閾値を超えた遅い生成を入力ハッシュとフェーズ内訳つきでログに残す
+"""
+
+import cProfile
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+from metrics import phase_collector
+from render_cache import content_hash
+
+# KYOZAI_PROFILING=1 のときだけ、ヘッダー/クエリによるプロファイル要求を受け付ける
+PROFILING_ENABLED = os.environ.get('KYOZAI_PROFILING', '') not in ('', '0', 'false')
+PROFILE_HEADER = 'x-kyozai-profile'
+PROFILE_DIR = os.environ.get('KYOZAI_PROFILE_DIR')
+SLOW_REQUEST_MS = float(os.environ.get('KYOZAI_SLOW_REQUEST_MS', 1000))
+TOP_N = 25
+
+slow_logger = logging.getLogger('kyozai.slow')
+
+# tracemalloc の状態はプロセス全体で1つなので、プロファイル付きの生成は1件ずつ行う
+_profile_lock = threading.Lock()
+
+
+def profiling_requested(headers, query_params) -> bool:
+    """プロファイリングが有効で、かつリクエストが要求しているか"""
+    if not PROFILING_ENABLED:
+        return False
+    flag = headers.get(PROFILE_HEADER) or query_params.get('profile')
+    return flag not in (None, '', '0', 'false')
+
+
+def collect_phases(func, *args):
+    """func(*args) を実行し (結果, フェーズ別所要時間[秒]) を返す（ワーカー内で呼ぶ）"""
+    phases = {}
+    token = phase_collector.set(phases)
+    try:
+        return func(*args), phases
+    finally:
+        phase_collector.reset(token)
+
+
+def profile_call(func, *args):
+    """func(*args) を cProfile と tracemalloc の下で実行し (結果, レポート) を返す。
+    同時に要求されたプロファイルは順に実行する（実行中に他方が tracemalloc を止めないように）"""
+    with _profile_lock:
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        else:
+            # 既に計測中なら、ピークをこの生成の分だけにする
+            tracemalloc.reset_peak()
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            result, phases = collect_phases(func, *args)
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - start
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+
+    stats = pstats.Stats(profiler)
+    functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_N]
+    report = {
+        'elapsed_ms': elapsed * 1000,
+        'peak_memory_bytes': peak,
+        'phases_ms': {name: seconds * 1000 for name, seconds in phases.items()},
+        'functions': [
+            {
+                'function': f'{filename}:{lineno}({name})',
+                'calls': calls,
+                'total_ms': total * 1000,
+                'cumulative_ms': cumulative * 1000,
+            }
+            for (filename, lineno, name), (_, calls, total, cumulative, _) in functions
+        ],
+        'allocations': [
+            {'site': str(stat.traceback), 'size_bytes': stat.size, 'count': stat.count}
+            for stat in snapshot.statistics('lineno')[:TOP_N]
+        ],
+    }
+    return result, report
+
+
+def store_report(endpoint: str, input_hash: str, report: dict) -> str | None:
+    """KYOZAI_PROFILE_DIR が設定されていればレポートをJSONで保存し、そのパスを返す"""
+    if not PROFILE_DIR:
+        return None
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    filename = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{endpoint}-{input_hash[:12]}.json"
+    path = os.path.join(PROFILE_DIR, filename)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'endpoint': endpoint, 'input_hash': input_hash, **report}, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def log_if_slow(endpoint: str, yaml_content: str, elapsed: float, phases: dict):
+    """生成時間が閾値を超えた場合、入力ハッシュとフェーズ内訳を記録"""
+    elapsed_ms = elapsed * 1000
+    if elapsed_ms < SLOW_REQUEST_MS:
+        return
+    slow_logger.warning(json.dumps({
+        'endpoint': endpoint,
+        'input_hash': content_hash(yaml_content),
+        'elapsed_ms': round(elapsed_ms, 1),
+        'phases_ms': {name: round(seconds * 1000, 1) for name, seconds in phases.items()},
+    }, ensure_ascii=False))
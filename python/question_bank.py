@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+問題バンク
+過去のテスト・プリントのYAMLから小問・問題を取り出して SQLite FTS5 に索引し、
+全文検索と、選んだ問題からのテストYAMLの組み立てを行う
+
+使い方:
+    python question_bank.py index <ディレクトリ/ファイル>...
+    python question_bank.py search <検索語>
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import yaml
+
+from render_cache import content_hash
+from yaml_loader import SafeLoader, detect_doctype
+
+DEFAULT_PATH = os.environ.get(
+    'KYOZAI_QUESTION_BANK',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'question_bank.sqlite3'),
+)
+YAML_EXTENSIONS = ('.yaml', '.yml')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    doctype TEXT NOT NULL,
+    title TEXT NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    doctype TEXT NOT NULL,
+    section TEXT NOT NULL,
+    number TEXT NOT NULL,
+    body TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    explanation TEXT NOT NULL,
+    score REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_path ON items(path);
+-- 日本語は単語区切りがないため trigram で索引する（3文字未満の検索語は LIKE で絞り込む）
+CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+    body, answer, explanation, section, tokenize='trigram'
+);
+"""
+
+# 検索する列と、bm25 の列ごとの重み（本文, 解答, 解説, 大問タイトル。items_fts の列順）
+_COLUMN_WEIGHTS = (('body', 4.0), ('answer', 1.0), ('explanation', 2.0), ('section', 1.0))
+_BM25_WEIGHTS = ', '.join(str(weight) for _, weight in _COLUMN_WEIGHTS)
+
+
+def _text(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return '\n'.join(_text(v) for v in value)
+    return str(value)
+
+
+def _score(value) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def extract_items(data, doctype: str) -> list[dict]:
+    """索引する問題を取り出す（テストは大問ごとの小問、プリントは見出し以外の問題）"""
+    items = []
+    if doctype == 'exam':
+        for q in data.get('大問', []):
+            if not isinstance(q, dict):
+                continue
+            section = _text(q.get('タイトル', q.get('番号', '')))
+            for sub in q.get('小問', q.get('問題', [])) or []:
+                if not isinstance(sub, dict):
+                    sub = {'本文': sub}
+                items.append({
+                    'section': section,
+                    'number': _text(sub.get('番号', '')),
+                    'body': _text(sub.get('本文', '')),
+                    'answer': _text(sub.get('解答', '')),
+                    'explanation': _text(sub.get('解説', '')),
+                    'score': _score(sub.get('配点')),
+                    'data': sub,
+                })
+    elif doctype == 'worksheet':
+        section = ''
+        for i, prob in enumerate(data.get('問題', [])):
+            if not isinstance(prob, dict):
+                continue
+            if prob.get('type') == 'header':
+                section = _text(prob.get('text', ''))
+                continue
+            subs = [s.get('本文', '') if isinstance(s, dict) else s for s in prob.get('小問', []) or []]
+            items.append({
+                'section': section,
+                'number': _text(prob.get('番号', i + 1)),
+                'body': '\n'.join(filter(None, [_text(prob.get('本文', '')), _text(subs)])),
+                'answer': _text(prob.get('解答', '')),
+                'explanation': _text(prob.get('解説', '')),
+                'score': _score(prob.get('配点')),
+                'data': prob,
+            })
+    return items
+
+
+def _escape_like(term: str) -> str:
+    """LIKE のワイルドカード（% _）と エスケープ文字そのものを文字として扱う"""
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _fts_query(query: str) -> str:
+    """検索語を空白で区切り、各語をフレーズとして AND 検索する FTS5 クエリにする"""
+    terms = query.split()
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+class QuestionBank:
+    """問題バンク（操作ごとに接続を開くため、スレッドをまたいで使える）"""
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA foreign_keys = ON')
+        conn.execute('PRAGMA journal_mode = WAL')
+        return conn
+
+    # ---------- 索引 ----------
+
+    def index_document(self, path: str, yaml_content: str) -> str:
+        """1文書を索引する。内容ハッシュが前回と同じなら何もしない。
+        戻り値: 'indexed' / 'unchanged' / 'skipped'（テスト・プリント以外）"""
+        digest = content_hash(yaml_content)
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT hash FROM files WHERE path = ?', (path,)).fetchone()
+            if row is not None and row['hash'] == digest:
+                return 'unchanged'
+            data = yaml.load(yaml_content, Loader=SafeLoader)
+            doctype = detect_doctype(data)
+            with conn:
+                self._remove_locked(conn, path)
+                if doctype not in ('exam', 'worksheet'):
+                    return 'skipped'
+                title = _text(data.get('タイトル', data.get('試験名', '')))
+                conn.execute(
+                    'INSERT INTO files (path, hash, doctype, title, indexed_at) VALUES (?, ?, ?, ?, ?)',
+                    (path, digest, doctype, title, time.time()),
+                )
+                for item in extract_items(data, doctype):
+                    cursor = conn.execute(
+                        'INSERT INTO items (path, doctype, section, number, body, answer, explanation, score, data)'
+                        ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (path, doctype, item['section'], item['number'], item['body'], item['answer'],
+                         item['explanation'], item['score'], json.dumps(item['data'], ensure_ascii=False, default=str)),
+                    )
+                    conn.execute(
+                        'INSERT INTO items_fts (rowid, body, answer, explanation, section) VALUES (?, ?, ?, ?, ?)',
+                        (cursor.lastrowid, item['body'], item['answer'], item['explanation'], item['section']),
+                    )
+            return 'indexed'
+        finally:
+            conn.close()
+
+    def _remove_locked(self, conn: sqlite3.Connection, path: str):
+        conn.execute('DELETE FROM items_fts WHERE rowid IN (SELECT id FROM items WHERE path = ?)', (path,))
+        conn.execute('DELETE FROM items WHERE path = ?', (path,))
+        conn.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def index_paths(self, paths) -> dict:
+        """ファイル・ディレクトリ配下のYAMLを索引し、消えたファイルを索引から除く"""
+        stats = {'indexed': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0, 'removed': 0}
+        seen = set()
+        roots = [os.path.abspath(p) for p in paths]
+        for path in _iter_yaml_files(roots):
+            seen.add(path)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    stats[self.index_document(path, f.read())] += 1
+            except Exception:
+                # 1ファイルの誤り（読み込み・YAML・日付など変換できない値）で索引全体を止めない
+                stats['failed'] += 1
+
+        conn = self._connect()
+        try:
+            with conn:
+                for row in conn.execute('SELECT path FROM files').fetchall():
+                    path = row['path']
+                    under_root = any(path == root or path.startswith(root + os.sep) for root in roots)
+                    if under_root and path not in seen:
+                        self._remove_locked(conn, path)
+                        stats['removed'] += 1
+        finally:
+            conn.close()
+        return stats
+
+    # ---------- 検索 ----------
+
+    def search(self, query: str, limit: int = 20, doctype: str | None = None) -> list[dict]:
+        """全文検索（関連度順）。3文字以上の語は FTS5 の bm25 で順位を付け、
+        3文字未満の語（trigram では探せない）はいずれかの列に部分一致するものに絞り込む。
+        すべて3文字未満なら、一致した列の重みの合計が大きい順にする"""
+        terms = query.split()
+        if not terms:
+            return []
+        long_terms = [term for term in terms if len(term) >= 3]
+        short_terms = [term for term in terms if len(term) < 3]
+        conditions = []
+        params = []
+        for term in short_terms:
+            conditions.append('(' + ' OR '.join(
+                f"items.{column} LIKE ? ESCAPE '\\'" for column, _ in _COLUMN_WEIGHTS) + ')')
+            params.extend([f'%{_escape_like(term)}%'] * len(_COLUMN_WEIGHTS))
+        if doctype:
+            conditions.append('items.doctype = ?')
+            params.append(doctype)
+        if long_terms:
+            sql = f"""
+                SELECT items.id, items.path, items.doctype, items.section, items.number, items.score,
+                       snippet(items_fts, 0, '<mark>', '</mark>', '…', 24) AS snippet,
+                       bm25(items_fts, {_BM25_WEIGHTS}) AS rank
+                FROM items_fts JOIN items ON items.id = items_fts.rowid
+                WHERE {' AND '.join(['items_fts MATCH ?', *conditions])}
+                ORDER BY rank LIMIT ?"""
+            params.insert(0, _fts_query(' '.join(long_terms)))
+        else:
+            # bm25 と同じく小さいほど上位（一致した列の重みの合計を負にする）
+            matched = ' + '.join(
+                f"(items.{column} LIKE ? ESCAPE '\\') * {weight}"
+                for _ in short_terms for column, weight in _COLUMN_WEIGHTS)
+            sql = f"""
+                SELECT items.id, items.path, items.doctype, items.section, items.number, items.score,
+                       substr(items.body, 1, 80) AS snippet, -({matched}) AS rank
+                FROM items WHERE {' AND '.join(conditions)}
+                ORDER BY rank, items.id LIMIT ?"""
+            params = [f'%{_escape_like(term)}%' for term in short_terms for _ in _COLUMN_WEIGHTS] + params
+        params.append(limit)
+        conn = self._connect()
+        try:
+            return [dict(row) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    def get_items(self, item_ids: list[int]) -> list[dict]:
+        """指定した順序で問題を返す（存在しないIDは KeyError）"""
+        conn = self._connect()
+        try:
+            placeholders = ','.join('?' * len(item_ids))
+            rows = {
+                row['id']: row
+                for row in conn.execute(f'SELECT * FROM items WHERE id IN ({placeholders})', item_ids)
+            }
+        finally:
+            conn.close()
+        missing = [i for i in item_ids if i not in rows]
+        if missing:
+            raise KeyError(f'unknown item ids: {missing}')
+        return [{**dict(rows[i]), 'data': json.loads(rows[i]['data'])} for i in item_ids]
+
+    def stats(self) -> dict:
+        conn = self._connect()
+        try:
+            files = conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+            items = conn.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+        finally:
+            conn.close()
+        return {'path': self.path, 'files': files, 'items': items}
+
+    # ---------- 組み立て ----------
+
+    def assemble_exam(self, item_ids: list[int], header: dict | None = None) -> str:
+        """選んだ問題からテストYAMLを組み立てる。
+        元の大問（ファイル + 大問タイトル）が同じ問題は1つの大問にまとめ、番号を振り直す"""
+        sections: dict[tuple, dict] = {}
+        for item in self.get_items(item_ids):
+            key = (item['path'], item['section'])
+            section = sections.get(key)
+            if section is None:
+                section = sections[key] = {
+                    '番号': len(sections) + 1,
+                    'タイトル': item['section'] or f'問題{len(sections) + 1}',
+                    '小問': [],
+                }
+            section['小問'].append(_as_exam_sub(item, len(section['小問']) + 1))
+        for section in sections.values():
+            total = sum(sub.get('配点', 0) for sub in section['小問'] if isinstance(sub.get('配点'), (int, float)))
+            if total:
+                section['配点'] = total
+        document = {'タイトル': '定期考査', **(header or {}), '大問': list(sections.values())}
+        return yaml.safe_dump(document, allow_unicode=True, sort_keys=False)
+
+
+def _as_exam_sub(item: dict, position: int) -> dict:
+    """問題バンクの1問をテストの小問の形にする"""
+    if item['doctype'] == 'exam':
+        sub = dict(item['data'])
+    else:
+        sub = {'本文': item['body']}
+        if item['answer']:
+            sub['解答'] = item['answer'].replace('\n', '、')
+        if item['explanation']:
+            sub['解説'] = item['explanation']
+        if item['score'] is not None:
+            score = item['score']
+            sub['配点'] = int(score) if score.is_integer() else score
+    rest = {k: v for k, v in sub.items() if k not in ('番号', '改ページ')}
+    return {'番号': f'({position})', **rest}
+
+
+def _iter_yaml_files(roots):
+    for root in roots:
+        if os.path.isfile(root):
+            if root.endswith(YAML_EXTENSIONS):
+                yield root
+            continue
+        for dirpath, _, filenames in os.walk(root):
+            for filename in sorted(filenames):
+                if filename.endswith(YAML_EXTENSIONS):
+                    yield os.path.join(dirpath, filename)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in ('index', 'search'):
+        print(__doc__)
+        sys.exit(1)
+    bank = QuestionBank()
+    if sys.argv[1] == 'index':
+        print(bank.index_paths(sys.argv[2:]))
+    else:
+        for hit in bank.search(' '.join(sys.argv[2:])):
+            print(f"[{hit['id']}] {hit['path']} {hit['section']} {hit['number']}: {hit['snippet']}")
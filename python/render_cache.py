@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+レンダリング結果キャッシュ
+エンドポイント + YAMLのハッシュをキーに、生成済みの出力をバイト数上限付きLRUで保持する
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+def content_hash(content: str) -> str:
+    """文字列のSHA-256ハッシュ（16進）を返す"""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def subtree_hash(node) -> str:
+    """YAMLの部分木（dict/list）から安定したハッシュを計算"""
+    serialized = json.dumps(node, sort_keys=True, ensure_ascii=False, default=str)
+    return content_hash(serialized)
+
+
+def fragment_keys(digests) -> list[str]:
+    """部分木のハッシュの列から、文書内で一意な断片IDの後半を作る（同じ内容が重なれば -2, -3, … を付ける）"""
+    seen = {}
+    keys = []
+    for digest in digests:
+        key = digest[:16]
+        seen[key] = seen.get(key, 0) + 1
+        keys.append(key if seen[key] == 1 else f'{key}-{seen[key]}')
+    return keys
+
+
+def make_etag(value) -> str:
+    """出力内容から強いETagを生成"""
+    data = value.encode('utf-8') if isinstance(value, str) else bytes(value)
+    return '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """If-None-Match ヘッダーが指定のETagに一致するか判定"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate == etag:
+            return True
+    return False
+
+
+class CacheEntry:
+    __slots__ = ('value', 'size', 'key', 'variants', 'variant_bytes', 'download_name', '_etag')
+
+    def __init__(self, value, key: str | None = None):
+        self.value = value
+        self.size = len(value.encode('utf-8')) if isinstance(value, str) else len(value)
+        self.key = key
+        # 同じ出力の別表現（JSON化・圧縮済みなど）のバイト列
+        self.variants: dict[str, bytes] = {}
+        self.variant_bytes = 0  # variants の合計（size は生成結果そのものの大きさのまま）
+        self.download_name = None  # ダウンロードAPIで生成したときのファイル名（拡張子なし）
+        self._etag = None
+
+    @property
+    def etag(self) -> str:
+        # 断片キャッシュではETagを使わないため、必要になった時点で計算する
+        if self._etag is None:
+            self._etag = make_etag(self.value)
+        return self._etag
+
+
+class RenderCache:
+    """バイト数上限付きのLRUキャッシュ（スレッドセーフ）"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(endpoint: str, content: str, *options) -> str:
+        """エンドポイント名・オプション・コンテンツハッシュからキーを作成"""
+        parts = [endpoint, *(str(o) for o in options), content_hash(content)]
+        return ':'.join(parts)
+
+    def get(self, key: str) -> CacheEntry | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, value) -> CacheEntry:
+        entry = CacheEntry(value, key)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size + old.variant_bytes
+            # 上限を超える単体エントリはキャッシュしない
+            if entry.size > self.max_bytes:
+                return entry
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self._evict_locked()
+        return entry
+
+    def variant(self, entry: CacheEntry, name: str, build) -> bytes:
+        """エントリの別表現を返す。未作成なら build() で作成し、エントリと一緒に保持する"""
+        data = entry.variants.get(name)
+        if data is not None:
+            return data
+        data = build()
+        with self._lock:
+            if name in entry.variants:
+                return entry.variants[name]
+            entry.variants[name] = data
+            if entry.key is not None and self._entries.get(entry.key) is entry:
+                entry.variant_bytes += len(data)
+                self._bytes += len(data)
+                self._evict_locked()
+        return data
+
+    def _evict_locked(self):
+        while self._bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size + evicted.variant_bytes
+            self.evictions += 1
+
+    def get_or_render(self, key: str, render) -> CacheEntry:
+        """キャッシュにあれば返し、なければ render() を実行して保存する"""
+        entry = self.get(key)
+        if entry is None:
+            entry = self.put(key, render())
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+# 大問・問題単位のHTML断片キャッシュ（全ジェネレーター共通、既定 16MB）
+fragment_cache = RenderCache(int(os.environ.get('KYOZAI_FRAGMENT_CACHE_BYTES', 16 * 1024 * 1024)))
@@ -5,19 +5,86 @@
 React アプリからのリクエストを処理し、HTML/Word を生成する
 """
 
-from fastapi import FastAPI, HTTPException
+import asyncio
+import html
+import json
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from functools import partial
+
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, HTMLResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+from starlette.requests import HTTPConnection
 import uvicorn
 
-from exam_generator import generate_exam_html
-from worksheet_generator import generate_worksheet_html
-from lesson_plan_generator import generate_lesson_plan_html, generate_lesson_plan_docx_base64
+from exam_generator import EXAM_CSS, ExamGenerator, generate_exam_html, iter_exam_html
+from exam_variants import generate_exam_variants
+from worksheet_generator import WORKSHEET_CSS, WorksheetGenerator, generate_worksheet_html, iter_worksheet_html
+from lesson_plan_generator import (
+    LESSON_PLAN_CSS,
+    LessonPlanGenerator,
+    generate_lesson_plan_html,
+    generate_lesson_plan_docx_base64,
+    generate_lesson_plan_docx_bytes,
+    iter_lesson_plan_html,
+)
+from bulk_export import stream_export_zip
+from compression import MIN_COMPRESS_BYTES, compress, minify_html, negotiate
+from downloads import DOCX_MEDIA_TYPE, HTML_MEDIA_TYPE, content_disposition
+from export_formats import HTML_FORMATS, render_formats_json, validate_formats
+from markdown_engine import markdown_engine
+import mathjax
+from mathjax import MATHJAX_ENTRY, MATHJAX_VERSION
+import metrics
+from profiling import collect_phases, log_if_slow, profile_call, profiling_requested, store_report
+from models import document_caches
+from preview import GENERATORS as PREVIEW_GENERATORS, PreviewSession, render_fragments
+from question_bank import QuestionBank
+from render_cache import CacheEntry, RenderCache, content_hash, etag_matches, fragment_cache
+from stream_parse import iter_exam_html_streaming, iter_worksheet_html_streaming
+from stylesheets import StylesheetRegistry
+from yaml_loader import parsed_cache
+from watch import WatchService, format_sse, with_reload_script
+from workers import BatchRenderer, RenderDispatcher, RenderQueueFull, RenderSlot, download_name, render_with_name
+
+# 一括生成用プロセスプール（既定はCPUコア数）
+batch_renderer = BatchRenderer(int(os.environ.get("KYOZAI_BATCH_WORKERS", 0)) or None)
+
+# 通常リクエストの生成ワーカー（thread/process）と待ち行列の上限
+render_dispatcher = RenderDispatcher(
+    kind=os.environ.get("KYOZAI_RENDER_EXECUTOR", "thread"),
+    max_workers=int(os.environ.get("KYOZAI_RENDER_WORKERS", 0)) or None,
+    max_queue=int(os.environ.get("KYOZAI_RENDER_MAX_QUEUE", 32)),
+)
+RETRY_AFTER_SECONDS = os.environ.get("KYOZAI_RETRY_AFTER", "1")
+
+# ウォッチモード（KYOZAI_WATCH_DIR 配下のYAMLを監視し、保存のたびに生成してSSEで通知する）
+WATCH_DIR = os.environ.get("KYOZAI_WATCH_DIR")
+watch_service = WatchService(WATCH_DIR, render_dispatcher.run) if WATCH_DIR else None
+SSE_HEARTBEAT_SECONDS = 15
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if watch_service is not None:
+        watch_service.start()
+    yield
+    if watch_service is not None:
+        await watch_service.stop()
+    render_dispatcher.shutdown()
+    batch_renderer.shutdown()
+
 
 app = FastAPI(
     title="教材作成API",
     description="YAMLからHTML/Word教材を生成するAPI",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # CORS設定（開発用）
@@ -27,23 +94,379 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Content-Disposition", "Content-Encoding"],
 )
 
 
+@app.middleware("http")
+async def record_http_metrics(request: Request, call_next):
+    """エンドポイント別のリクエスト数とレイテンシを記録"""
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    endpoint = getattr(route, "path", "unmatched")
+    metrics.http_requests.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    metrics.http_latency.observe(time.perf_counter() - start, endpoint=endpoint, method=request.method)
+    return response
+
+
+# レンダリング結果キャッシュ（既定 64MB）
+render_cache = RenderCache(int(os.environ.get("KYOZAI_RENDER_CACHE_BYTES", 64 * 1024 * 1024)))
+
+# MathJax（python fetch_mathjax.py で取得したバンドルがあればローカルから配信する）
+MATHJAX_LOCAL = mathjax.local_bundle_available()
+
+stylesheets = StylesheetRegistry()
+stylesheets.register("exam", EXAM_CSS)
+stylesheets.register("worksheet", WORKSHEET_CSS)
+stylesheets.register("lesson-plan", LESSON_PLAN_CSS)
+
+
 class GenerateRequest(BaseModel):
     yaml_content: str
+    external_css: bool = False  # True の場合、CSSをインラインではなく /styles/ から参照する
+    minify: bool = False  # True の場合、HTMLのインデント・空行を取り除く
+    stream_parse: bool = False  # True の場合、generate-stream でYAMLを大問/問題ごとに逐次解析する（大きな文書向け）
 
 
 class GenerateResponse(BaseModel):
     html: str
     success: bool
     error: str | None = None
+    profile: dict | None = None  # プロファイル要求時のみ（KYOZAI_PROFILING=1）
+
+
+class BatchGenerateRequest(BaseModel):
+    yaml_contents: list[str]
+
+
+class BatchGenerateResponse(BaseModel):
+    results: list[GenerateResponse]
 
 
 class DocxResponse(BaseModel):
     docx_base64: str
     success: bool
     error: str | None = None
+    profile: dict | None = None
+
+
+class ExportFormatsRequest(BaseModel):
+    yaml_content: str
+    formats: list[str] = ["html"]  # html / problems / answer-key（テスト・プリント）、html / docx（指導案）
+    external_css: bool = False
+    minify: bool = False
+
+
+class ExportFormatsResponse(BaseModel):
+    outputs: dict[str, str]  # 形式 → 出力（DOCXはBase64）
+    success: bool
+    error: str | None = None
+    profile: dict | None = None
+
+
+class ExamVariantsRequest(BaseModel):
+    yaml_content: str
+    count: int = 2
+    seed: int = 0
+    shuffle_choices: bool = False  # True の場合、選択肢の順序も入れ替える
+    external_css: bool = False
+
+
+class ExamVariantsResponse(BaseModel):
+    variants: list[dict]  # [{label, seed, index, html, answer_key}]
+    success: bool
+    error: str | None = None
+
+
+class ExportRequest(BaseModel):
+    directory: str  # KYOZAI_EXPORT_ROOTS 配下のディレクトリ
+
+
+class AssembleExamRequest(BaseModel):
+    item_ids: list[int]
+    header: dict = {}  # タイトル・学校名・科目・試験時間・注意事項など
+
+
+class AssembleExamResponse(BaseModel):
+    yaml_content: str
+    success: bool
+    error: str | None = None
+
+
+# 生成中のキャッシュキー → 生成タスク（同一内容の同時リクエストは1回の生成を待ち合わせて共有する）
+_in_flight: dict[str, asyncio.Task] = {}
+coalescing_stats = {"renders": 0, "coalesced": 0}
+
+
+async def _render_entry(endpoint: str, key: str, yaml_content: str, render, *options, name_from=None) -> CacheEntry:
+    start = time.perf_counter()
+    if name_from is not None:
+        # ダウンロード用のファイル名も同じワーカーで求める
+        render = partial(render_with_name, name_from, render)
+    try:
+        value, phases = await render_dispatcher.run(collect_phases, render, yaml_content, *options)
+    except RenderQueueFull:
+        raise
+    except Exception:
+        metrics.render_errors.inc(endpoint=endpoint)
+        raise
+    log_if_slow(endpoint, yaml_content, time.perf_counter() - start, phases)
+    if name_from is None:
+        return render_cache.put(key, value)
+    value, name = value
+    entry = render_cache.put(key, value)
+    entry.download_name = name
+    return entry
+
+
+def _finish_in_flight(key: str, task: asyncio.Task):
+    _in_flight.pop(key, None)
+    if not task.cancelled():
+        task.exception()  # 待っていた全員が切断していても「未取得の例外」警告を出さない
+
+
+async def _render_cached(endpoint: str, yaml_content: str, render, *options, name_from=None):
+    """同一エンドポイント・同一YAML・同一オプションの生成結果はキャッシュから返す。
+    キャッシュにない場合はワーカーで生成する（イベントループはブロックしない）。
+    同じキーの生成が進行中なら、新たに生成せずその結果を待つ。
+    name_from（ジェネレータクラス）を渡すと、生成と一緒にダウンロード時のファイル名も求めてエントリに持たせる"""
+    metrics.input_size.observe(len(yaml_content.encode("utf-8")), endpoint=endpoint)
+    key = RenderCache.make_key(endpoint, yaml_content, *options)
+    entry = render_cache.get(key)
+    if entry is None:
+        task = _in_flight.get(key)
+        if task is None:
+            # 生成は最初のリクエストから切り離して実行する（そのクライアントが切断しても他の待ち手に結果を届ける）
+            task = asyncio.create_task(
+                _render_entry(endpoint, key, yaml_content, render, *options, name_from=name_from)
+            )
+            _in_flight[key] = task
+            task.add_done_callback(lambda t: _finish_in_flight(key, t))
+            coalescing_stats["renders"] += 1
+        else:
+            coalescing_stats["coalesced"] += 1
+            metrics.render_coalesced.inc(endpoint=endpoint)
+        entry = await asyncio.shield(task)
+    metrics.output_size.observe(entry.size, endpoint=endpoint)
+    return entry
+
+
+async def _render_for(http_request: Request, endpoint: str, yaml_content: str, render, *options):
+    """(結果, プロファイルレポート) を返す。プロファイル要求時はキャッシュを使わずに計測しながら生成する"""
+    if not profiling_requested(http_request.headers, http_request.query_params):
+        return await _render_cached(endpoint, yaml_content, render, *options), None
+    try:
+        value, report = await render_dispatcher.run(profile_call, render, yaml_content, *options)
+    except RenderQueueFull:
+        raise
+    except Exception:
+        metrics.render_errors.inc(endpoint=endpoint)
+        raise
+    stored = store_report(endpoint, content_hash(yaml_content), report)
+    if stored:
+        report["stored_as"] = stored
+    return CacheEntry(value), report
+
+
+def _overloaded() -> HTTPException:
+    """生成待ち行列が満杯のときの 503 応答"""
+    return HTTPException(
+        status_code=503,
+        detail="生成処理が混雑しています。しばらくしてから再試行してください",
+        headers={"Retry-After": RETRY_AFTER_SECONDS},
+    )
+
+
+async def _render_batch(endpoint: str, yaml_contents: list[str]) -> BatchGenerateResponse:
+    """キャッシュにない文書だけをプロセスプールで生成し、入力順に結果を返す"""
+    keys = [RenderCache.make_key(endpoint, y) for y in yaml_contents]
+    results: list[GenerateResponse | None] = []
+    pending = []
+    for i, key in enumerate(keys):
+        entry = render_cache.get(key)
+        if entry is None:
+            results.append(None)
+            pending.append(i)
+        else:
+            results.append(GenerateResponse(html=entry.value, success=True))
+
+    rendered = await batch_renderer.render_many(endpoint, [yaml_contents[i] for i in pending])
+    for i, (ok, value) in zip(pending, rendered):
+        if ok:
+            render_cache.put(keys[i], value)
+            results[i] = GenerateResponse(html=value, success=True)
+        else:
+            metrics.render_errors.inc(endpoint=endpoint)
+            results[i] = GenerateResponse(html="", success=False, error=value)
+    return BatchGenerateResponse(results=results)
+
+
+def _stylesheet_url(http_request: HTTPConnection, doctype: str, external_css: bool) -> str | None:
+    """外部CSSを要求された場合、バージョン付きスタイルシートの絶対URLを返す"""
+    if not external_css:
+        return None
+    return str(http_request.url_for("get_stylesheet", filename=stylesheets.filename(doctype)))
+
+
+def _mathjax_url(http_request: HTTPConnection) -> str | None:
+    """ローカルのMathJaxバンドルがあれば、その絶対URLを返す（なければ生成側の既定URL）"""
+    if not MATHJAX_LOCAL:
+        return None
+    return str(http_request.url_for("get_mathjax", version=MATHJAX_VERSION, path=MATHJAX_ENTRY))
+
+
+async def _respond(
+    http_request: Request,
+    entry: CacheEntry,
+    name: str,
+    build,
+    media_type: str,
+    headers: dict | None = None,
+    store_plain: bool = True,
+    compressible: bool = True,
+) -> Response:
+    """生成結果の表現（JSON・生HTMLなど）を返す。
+    build() で作った本文と、Accept-Encoding に応じた圧縮版はキャッシュエントリに保持して再利用する"""
+    encoding = negotiate(http_request.headers.get("accept-encoding")) if compressible else None
+    if entry.size < MIN_COMPRESS_BYTES:
+        encoding = None
+    variant = f"{name}+{encoding}" if encoding else name
+    etag = entry.etag if variant == "json" else f'{entry.etag[:-1]}-{variant}"'
+    response_headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+    if etag_matches(http_request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=response_headers)
+
+    body = entry.variants.get(variant)
+    if body is None:
+        if store_plain:
+            body = entry.variants.get(name) or await run_in_threadpool(render_cache.variant, entry, name, build)
+        else:
+            body = await run_in_threadpool(build)
+        if encoding:
+            plain = body
+            body = await run_in_threadpool(render_cache.variant, entry, variant, lambda: compress(plain, encoding))
+    if encoding:
+        response_headers["Content-Encoding"] = encoding
+    response_headers.update(headers or {})
+    return Response(content=body, media_type=media_type, headers=response_headers)
+
+
+def _html_of(entry: CacheEntry, minify: bool) -> str:
+    return minify_html(entry.value) if minify else entry.value
+
+
+async def _send_generated(http_request: Request, entry: CacheEntry, minify: bool) -> Response:
+    """GenerateResponse のJSONを（必要なら最小化・圧縮して）返す"""
+    return await _respond(
+        http_request,
+        entry,
+        "json:min" if minify else "json",
+        lambda: GenerateResponse(html=_html_of(entry, minify), success=True).model_dump_json().encode("utf-8"),
+        "application/json",
+    )
+
+
+async def _download(
+    endpoint: str,
+    yaml_content: str,
+    render,
+    generator_cls,
+    http_request: Request,
+    extension: str,
+    media_type: str,
+    fallback_name: str,
+    minify: bool = False,
+) -> Response:
+    """生成結果をそのままのバイト列で返す（base64やJSONで包まない）"""
+    try:
+        # HTMLは通常の生成APIとキャッシュを共有する（外部CSSなし = None）
+        options = () if extension == ".docx" else (None, _mathjax_url(http_request))
+        entry = await _render_cached(endpoint, yaml_content, render, *options, name_from=generator_cls)
+        if entry.download_name is None:
+            # 通常の生成APIで作られたエントリにはファイル名がないので、ワーカーで求めて持たせる
+            entry.download_name = await render_dispatcher.run(download_name, generator_cls, yaml_content)
+        name = entry.download_name
+    except RenderQueueFull:
+        raise _overloaded()
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"Content-Disposition": content_disposition(f"{name}{extension}", f"{fallback_name}{extension}")}
+    if extension == ".docx":
+        # DOCXはZIP圧縮済みのため再圧縮しない
+        return await _respond(
+            http_request, entry, "raw", lambda: entry.value, media_type, headers,
+            store_plain=False, compressible=False,
+        )
+    return await _respond(
+        http_request,
+        entry,
+        "raw:min" if minify else "raw",
+        lambda: _html_of(entry, minify).encode("utf-8"),
+        media_type,
+        headers,
+        store_plain=minify,
+    )
+
+
+async def _export_formats(doctype: str, request: ExportFormatsRequest, http_request: Request):
+    """1回の解析・生成から複数の形式をまとめて返す"""
+    try:
+        formats = tuple(validate_formats(doctype, request.formats))
+        entry, report = await _render_for(
+            http_request,
+            f"{doctype}-export",
+            request.yaml_content,
+            render_formats_json,
+            doctype,
+            formats,
+            _stylesheet_url(http_request, doctype, request.external_css),
+            _mathjax_url(http_request),
+        )
+    except RenderQueueFull:
+        raise _overloaded()
+    except Exception as e:
+        return ExportFormatsResponse(outputs={}, success=False, error=str(e))
+
+    def build() -> ExportFormatsResponse:
+        outputs = json.loads(entry.value)
+        if request.minify:
+            outputs = {f: minify_html(v) if f in HTML_FORMATS else v for f, v in outputs.items()}
+        return ExportFormatsResponse(outputs=outputs, success=True, profile=report)
+
+    if report is not None:
+        return build()
+    return await _respond(
+        http_request,
+        entry,
+        "json:min" if request.minify else "json",
+        lambda: build().model_dump_json().encode("utf-8"),
+        "application/json",
+    )
+
+
+async def _stream_html(yaml_content: str, iter_html, *options) -> StreamingResponse:
+    """HTMLを断片ごとにチャンク転送する（YAMLエラーは送信開始前に400で返す）。
+    送信が終わるまで生成ワーカーの枠を1つ使い、待ち行列が満杯なら503を返す"""
+    try:
+        slot = render_dispatcher.reserve()
+    except RenderQueueFull:
+        raise _overloaded()
+    try:
+        # 解析（逐次解析では最初の断片まで）もイベントループの外で行う
+        chunks = await run_in_threadpool(iter_html, yaml_content, *options)
+    except Exception as e:
+        slot.release()
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(_release_after(slot, chunks), media_type="text/html; charset=utf-8")
+
+
+async def _release_after(slot: RenderSlot, chunks):
+    try:
+        async for chunk in iterate_in_threadpool(chunks):
+            yield chunk
+    finally:
+        slot.release()
 
 
 @app.get("/")
@@ -53,53 +476,469 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "render_cache": render_cache.stats(),
+        # 断片・Markdown・解析結果のキャッシュはプロセスごとに持つため、
+        # KYOZAI_RENDER_EXECUTOR=process や一括生成ではワーカープロセス側の命中はここに含まれない
+        "fragment_cache": fragment_cache.stats(),
+        "markdown": markdown_engine.stats(),
+        "yaml": parsed_cache.stats(),
+        "models": {doctype: cache.stats() for doctype, cache in document_caches.items()},
+        "workers": render_dispatcher.stats(),
+        "coalescing": {"in_flight": len(_in_flight), **coalescing_stats},
+        "mathjax": {"version": MATHJAX_VERSION, "local": MATHJAX_LOCAL},
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus テキスト形式のメトリクス"""
+    return PlainTextResponse(metrics.registry.expose(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# 外部参照用スタイルシート（URLに内容ハッシュを含めるため長期キャッシュ可能）
+@app.get("/styles/{filename}")
+async def get_stylesheet(filename: str):
+    """内容ハッシュ付きのスタイルシートを返す（内容が変わればURLも変わる）"""
+    sheet = stylesheets.lookup(filename)
+    if sheet is None:
+        raise HTTPException(status_code=404, detail="stylesheet not found")
+    version, css = sheet
+    return Response(
+        content=css,
+        media_type="text/css; charset=utf-8",
+        headers={"Cache-Control": "public, max-age=31536000, immutable", "ETag": f'"{version}"'},
+    )
+
+
+@app.get("/vendor/mathjax/{version}/{path:path}")
+async def get_mathjax(version: str, path: str):
+    """ローカルに置いた固定バージョンのMathJaxを配信する（バージョンがURLに含まれるため不変）"""
+    full_path = mathjax.local_path(path) if MATHJAX_LOCAL and version == MATHJAX_VERSION else None
+    if full_path is None:
+        raise HTTPException(status_code=404, detail="not found")
+    return FileResponse(full_path, headers={"Cache-Control": "public, max-age=31536000, immutable"})
 
 
 # ========== テスト（定期考査）API ==========
 
 @app.post("/api/exam/generate", response_model=GenerateResponse)
-async def generate_exam(request: GenerateRequest):
+async def generate_exam(request: GenerateRequest, http_request: Request):
     """YAMLコンテンツからHTML定期考査を生成"""
     try:
-        html = generate_exam_html(request.yaml_content)
-        return GenerateResponse(html=html, success=True)
+        entry, report = await _render_for(
+            http_request,
+            "exam",
+            request.yaml_content,
+            generate_exam_html,
+            _stylesheet_url(http_request, "exam", request.external_css),
+            _mathjax_url(http_request),
+        )
+    except RenderQueueFull:
+        raise _overloaded()
     except Exception as e:
         return GenerateResponse(html="", success=False, error=str(e))
+    if report is not None:
+        return GenerateResponse(html=entry.value, success=True, profile=report)
+    return await _send_generated(http_request, entry, request.minify)
+
+
+@app.post("/api/exam/generate-stream")
+async def stream_exam(request: GenerateRequest, http_request: Request):
+    """YAMLコンテンツからHTML定期考査をストリーミング生成"""
+    return await _stream_html(
+        request.yaml_content,
+        iter_exam_html_streaming if request.stream_parse else iter_exam_html,
+        _stylesheet_url(http_request, "exam", request.external_css),
+        _mathjax_url(http_request),
+    )
+
+
+@app.post("/api/exam/generate-batch", response_model=BatchGenerateResponse)
+async def generate_exam_batch(request: BatchGenerateRequest):
+    """複数のYAMLコンテンツからHTML定期考査を一括生成"""
+    return await _render_batch("exam", request.yaml_contents)
+
+
+@app.post("/api/exam/download-html")
+async def download_exam_html(request: GenerateRequest, http_request: Request):
+    """YAMLコンテンツからHTML定期考査をファイルとしてダウンロード"""
+    return await _download(
+        "exam", request.yaml_content, generate_exam_html, ExamGenerator,
+        http_request, ".html", HTML_MEDIA_TYPE, "exam", request.minify,
+    )
+
+
+MAX_EXAM_VARIANTS = int(os.environ.get("KYOZAI_MAX_EXAM_VARIANTS", 100))
+
+
+@app.post("/api/exam/generate-variants", response_model=ExamVariantsResponse)
+async def generate_exam_variants_endpoint(request: ExamVariantsRequest, http_request: Request):
+    """小問（と選択肢）の順序を入れ替えたテストを count 版生成し、版ごとの解答一覧を返す"""
+    if not 1 <= request.count <= MAX_EXAM_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"count must be between 1 and {MAX_EXAM_VARIANTS}")
+    try:
+        variants = await render_dispatcher.run(
+            generate_exam_variants,
+            request.yaml_content,
+            request.count,
+            request.seed,
+            request.shuffle_choices,
+            _stylesheet_url(http_request, "exam", request.external_css),
+            _mathjax_url(http_request),
+        )
+    except RenderQueueFull:
+        raise _overloaded()
+    except Exception as e:
+        metrics.render_errors.inc(endpoint="exam-variants")
+        return ExamVariantsResponse(variants=[], success=False, error=str(e))
+    return ExamVariantsResponse(variants=variants, success=True)
+
+
+@app.post("/api/exam/export", response_model=ExportFormatsResponse)
+async def export_exam(request: ExportFormatsRequest, http_request: Request):
+    """YAMLコンテンツからテストの複数形式（HTML・問題のみ・解答のみ）を一度に生成"""
+    return await _export_formats("exam", request, http_request)
 
 
 # ========== プリント（ワークシート）API ==========
 
 @app.post("/api/worksheet/generate", response_model=GenerateResponse)
-async def generate_worksheet(request: GenerateRequest):
+async def generate_worksheet(request: GenerateRequest, http_request: Request):
     """YAMLコンテンツからHTMLプリントを生成"""
     try:
-        html = generate_worksheet_html(request.yaml_content)
-        return GenerateResponse(html=html, success=True)
+        entry, report = await _render_for(
+            http_request,
+            "worksheet",
+            request.yaml_content,
+            generate_worksheet_html,
+            _stylesheet_url(http_request, "worksheet", request.external_css),
+            _mathjax_url(http_request),
+        )
+    except RenderQueueFull:
+        raise _overloaded()
     except Exception as e:
         return GenerateResponse(html="", success=False, error=str(e))
+    if report is not None:
+        return GenerateResponse(html=entry.value, success=True, profile=report)
+    return await _send_generated(http_request, entry, request.minify)
+
+
+@app.post("/api/worksheet/generate-stream")
+async def stream_worksheet(request: GenerateRequest, http_request: Request):
+    """YAMLコンテンツからHTMLプリントをストリーミング生成"""
+    return await _stream_html(
+        request.yaml_content,
+        iter_worksheet_html_streaming if request.stream_parse else iter_worksheet_html,
+        _stylesheet_url(http_request, "worksheet", request.external_css),
+        _mathjax_url(http_request),
+    )
+
+
+@app.post("/api/worksheet/generate-batch", response_model=BatchGenerateResponse)
+async def generate_worksheet_batch(request: BatchGenerateRequest):
+    """複数のYAMLコンテンツからHTMLプリントを一括生成"""
+    return await _render_batch("worksheet", request.yaml_contents)
+
+
+@app.post("/api/worksheet/download-html")
+async def download_worksheet_html(request: GenerateRequest, http_request: Request):
+    """YAMLコンテンツからHTMLプリントをファイルとしてダウンロード"""
+    return await _download(
+        "worksheet", request.yaml_content, generate_worksheet_html, WorksheetGenerator,
+        http_request, ".html", HTML_MEDIA_TYPE, "worksheet", request.minify,
+    )
+
+
+@app.post("/api/worksheet/export", response_model=ExportFormatsResponse)
+async def export_worksheet(request: ExportFormatsRequest, http_request: Request):
+    """YAMLコンテンツからプリントの複数形式（HTML・問題のみ・解答のみ）を一度に生成"""
+    return await _export_formats("worksheet", request, http_request)
 
 
 # ========== 指導案 API ==========
 
 @app.post("/api/lesson-plan/generate", response_model=GenerateResponse)
-async def generate_lesson_plan(request: GenerateRequest):
+async def generate_lesson_plan(request: GenerateRequest, http_request: Request):
     """YAMLコンテンツからHTML指導案を生成"""
     try:
-        html = generate_lesson_plan_html(request.yaml_content)
-        return GenerateResponse(html=html, success=True)
+        entry, report = await _render_for(
+            http_request,
+            "lesson-plan",
+            request.yaml_content,
+            generate_lesson_plan_html,
+            _stylesheet_url(http_request, "lesson-plan", request.external_css),
+            _mathjax_url(http_request),
+        )
+    except RenderQueueFull:
+        raise _overloaded()
     except Exception as e:
         return GenerateResponse(html="", success=False, error=str(e))
+    if report is not None:
+        return GenerateResponse(html=entry.value, success=True, profile=report)
+    return await _send_generated(http_request, entry, request.minify)
+
+
+@app.post("/api/lesson-plan/generate-stream")
+async def stream_lesson_plan(request: GenerateRequest, http_request: Request):
+    """YAMLコンテンツからHTML指導案をストリーミング生成"""
+    return await _stream_html(
+        request.yaml_content,
+        iter_lesson_plan_html,
+        _stylesheet_url(http_request, "lesson-plan", request.external_css),
+        _mathjax_url(http_request),
+    )
+
+
+@app.post("/api/lesson-plan/generate-batch", response_model=BatchGenerateResponse)
+async def generate_lesson_plan_batch(request: BatchGenerateRequest):
+    """複数のYAMLコンテンツからHTML指導案を一括生成"""
+    return await _render_batch("lesson-plan", request.yaml_contents)
+
+
+@app.post("/api/lesson-plan/download-html")
+async def download_lesson_plan_html(request: GenerateRequest, http_request: Request):
+    """YAMLコンテンツからHTML指導案をファイルとしてダウンロード"""
+    return await _download(
+        "lesson-plan", request.yaml_content, generate_lesson_plan_html, LessonPlanGenerator,
+        http_request, ".html", HTML_MEDIA_TYPE, "lesson-plan", request.minify,
+    )
 
 
 @app.post("/api/lesson-plan/generate-docx", response_model=DocxResponse)
-async def generate_lesson_plan_docx(request: GenerateRequest):
+async def generate_lesson_plan_docx(request: GenerateRequest, http_request: Request):
     """YAMLコンテンツからWord指導案を生成"""
     try:
-        docx_base64 = generate_lesson_plan_docx_base64(request.yaml_content)
-        return DocxResponse(docx_base64=docx_base64, success=True)
+        entry, report = await _render_for(
+            http_request, "lesson-plan-docx", request.yaml_content, generate_lesson_plan_docx_base64
+        )
+    except RenderQueueFull:
+        raise _overloaded()
     except Exception as e:
         return DocxResponse(docx_base64="", success=False, error=str(e))
+    if report is not None:
+        return DocxResponse(docx_base64=entry.value, success=True, profile=report)
+    return await _respond(
+        http_request,
+        entry,
+        "json",
+        lambda: DocxResponse(docx_base64=entry.value, success=True).model_dump_json().encode("utf-8"),
+        "application/json",
+    )
+
+
+@app.post("/api/lesson-plan/download-docx")
+async def download_lesson_plan_docx(request: GenerateRequest, http_request: Request):
+    """YAMLコンテンツからWord指導案を .docx ファイルとしてダウンロード"""
+    return await _download(
+        "lesson-plan-docx-bytes", request.yaml_content, generate_lesson_plan_docx_bytes, LessonPlanGenerator,
+        http_request, ".docx", DOCX_MEDIA_TYPE, "lesson-plan",
+    )
+
+
+@app.post("/api/lesson-plan/export", response_model=ExportFormatsResponse)
+async def export_lesson_plan(request: ExportFormatsRequest, http_request: Request):
+    """YAMLコンテンツから指導案の複数形式（HTML・Word）を一度に生成"""
+    return await _export_formats("lesson-plan", request, http_request)
+
+
+# ========== 問題バンク API ==========
+
+# 索引対象のディレクトリ（os.pathsep 区切り）。索引は初回利用時に開く
+QUESTION_BANK_DIRS = [p for p in os.environ.get("KYOZAI_QUESTION_BANK_DIRS", "").split(os.pathsep) if p]
+_question_bank: QuestionBank | None = None
+
+
+def _get_question_bank() -> QuestionBank:
+    global _question_bank
+    if _question_bank is None:
+        _question_bank = QuestionBank()
+    return _question_bank
+
+
+@app.post("/api/question-bank/reindex")
+async def reindex_question_bank():
+    """KYOZAI_QUESTION_BANK_DIRS 配下のYAMLを索引し直す（内容が変わったファイルだけ）"""
+    if not QUESTION_BANK_DIRS:
+        raise HTTPException(status_code=400, detail="KYOZAI_QUESTION_BANK_DIRS is not set")
+    bank = _get_question_bank()
+    return await run_in_threadpool(bank.index_paths, QUESTION_BANK_DIRS)
+
+
+@app.get("/api/question-bank/search")
+async def search_question_bank(q: str, limit: int = 20, doctype: str | None = None):
+    """問題バンクを全文検索（関連度順）"""
+    bank = _get_question_bank()
+    return {"results": await run_in_threadpool(bank.search, q, min(max(limit, 1), 200), doctype)}
+
+
+@app.post("/api/question-bank/assemble", response_model=AssembleExamResponse)
+async def assemble_exam(request: AssembleExamRequest):
+    """選んだ問題IDからテストのYAMLを組み立てる（/api/exam/generate にそのまま渡せる）"""
+    bank = _get_question_bank()
+    try:
+        yaml_content = await run_in_threadpool(bank.assemble_exam, request.item_ids, request.header)
+    except KeyError as e:
+        return AssembleExamResponse(yaml_content="", success=False, error=str(e.args[0]))
+    return AssembleExamResponse(yaml_content=yaml_content, success=True)
+
+
+# ========== 一括エクスポート API ==========
+
+# エクスポートを許可するディレクトリ（os.pathsep 区切り）
+EXPORT_ROOTS = [os.path.realpath(p) for p in os.environ.get("KYOZAI_EXPORT_ROOTS", "").split(os.pathsep) if p]
+# 同時に実行するエクスポートの数（生成は一括生成のプロセスプールを共有する）。超えた要求は 503
+export_slots = threading.BoundedSemaphore(int(os.environ.get("KYOZAI_EXPORT_MAX_CONCURRENT", 1)))
+
+
+async def _export_chunks(slot: RenderSlot, directory: str):
+    try:
+        async for chunk in stream_export_zip(directory, batch_renderer.max_workers, batch_renderer.executor()):
+            yield chunk
+    finally:
+        slot.release()
+
+
+@app.post("/api/export/zip")
+async def export_zip(request: ExportRequest):
+    """ディレクトリ配下のテスト・プリント・指導案をすべて生成し、ZIPとしてストリーミングで返す。
+    ファイルごとの結果は ZIP 内の _export_report.json に記録される"""
+    directory = os.path.realpath(request.directory)
+    if not any(directory == root or directory.startswith(root + os.sep) for root in EXPORT_ROOTS):
+        raise HTTPException(status_code=403, detail="directory is not under KYOZAI_EXPORT_ROOTS")
+    if not os.path.isdir(directory):
+        raise HTTPException(status_code=404, detail="directory not found")
+    # 枠は応答を返す前に確保する（送信が終わるか、送信されずに捨てられたときに返す）
+    if not export_slots.acquire(blocking=False):
+        raise _overloaded()
+    slot = RenderSlot(export_slots.release)
+    name = os.path.basename(directory) or "export"
+    return StreamingResponse(
+        _export_chunks(slot, directory),
+        media_type="application/zip",
+        headers={"Content-Disposition": content_disposition(f"{name}.zip", "export.zip")},
+    )
+
+
+# ========== ウォッチモード ==========
+
+def _watching() -> WatchService:
+    if watch_service is None:
+        raise HTTPException(status_code=404, detail="watch mode is not enabled (set KYOZAI_WATCH_DIR)")
+    return watch_service
+
+
+@app.get("/api/watch/files")
+async def watch_files():
+    """監視中のYAMLファイル一覧"""
+    service = _watching()
+    return {"root": service.root, "files": service.files()}
+
+
+@app.get("/api/watch/events")
+async def watch_events(path: str | None = None):
+    """生成結果の更新を Server-Sent Events で送る（path 指定時はそのファイルだけ、最初に現在の出力を送る）"""
+    service = _watching()
+    first = None
+    if path is not None:
+        try:
+            first = await service.get(path)
+        except RenderQueueFull:
+            raise _overloaded()
+        if first is None:
+            raise HTTPException(status_code=404, detail="file is not being watched")
+
+    async def events():
+        queue = service.subscribe()
+        try:
+            if first is not None:
+                yield format_sse({**first, "type": "snapshot"}, first.get("revision"))
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if path is None or event["path"] == path:
+                    yield format_sse(event, event["revision"])
+        finally:
+            service.unsubscribe(queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/watch/", response_class=HTMLResponse)
+async def watch_index():
+    """監視中のファイルへのリンク一覧"""
+    service = _watching()
+    links = "\n".join(
+        f'<li><a href="/watch/{html.escape(name)}">{html.escape(name)}</a></li>' for name in service.files()
+    )
+    return HTMLResponse(f"<!DOCTYPE html>\n<html lang=\"ja\">\n<body>\n<ul>\n{links}\n</ul>\n</body>\n</html>")
+
+
+@app.get("/watch/{path:path}", response_class=HTMLResponse)
+async def watch_document(path: str, http_request: Request):
+    """監視中のファイルの最新の出力（保存されると自動で再読み込みする）"""
+    service = _watching()
+    try:
+        event = await service.get(path)
+    except RenderQueueFull:
+        raise _overloaded()
+    if event is None:
+        raise HTTPException(status_code=404, detail="file is not being watched")
+    if event["error"]:
+        body = f"<!DOCTYPE html>\n<html lang=\"ja\">\n<body>\n<pre>{html.escape(event['error'])}</pre>\n</body>\n</html>"
+    else:
+        body = event["html"]
+    events_url = str(http_request.url_for("watch_events").include_query_params(path=path))
+    return HTMLResponse(with_reload_script(body, events_url), headers={"Cache-Control": "no-store"})
+
+
+# ========== ライブプレビュー ==========
+
+@app.websocket("/ws/preview/{doctype}")
+async def preview_socket(websocket: WebSocket, doctype: str):
+    """YAMLを受け取るたびに再生成し、前回から変わった断片だけを送る。
+
+    受信: {"yaml_content": "...", "external_css": false}
+    送信: {"type": "full" | "patch", "revision": n, "changed": [{"id", "html"}], "removed": [id], "order": [id]}
+          または {"type": "error", "error": "..."}（エラー時は前回の状態を保持する）
+    """
+    if doctype not in PREVIEW_GENERATORS:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    session = PreviewSession(doctype)
+    try:
+        while True:
+            message = await websocket.receive_json()
+            try:
+                fragments = await render_dispatcher.run(
+                    render_fragments,
+                    doctype,
+                    message.get("yaml_content", ""),
+                    _stylesheet_url(websocket, doctype, bool(message.get("external_css"))),
+                    _mathjax_url(websocket),
+                    session.known(),
+                )
+            except RenderQueueFull:
+                await websocket.send_json({"type": "error", "error": "busy", "retry_after": int(RETRY_AFTER_SECONDS)})
+                continue
+            except Exception as e:
+                metrics.render_errors.inc(endpoint=f"preview-{doctype}")
+                await websocket.send_json({"type": "error", "error": str(e)})
+                continue
+            patch = session.diff(fragments)
+            if patch is not None:
+                await websocket.send_json(patch)
+    except WebSocketDisconnect:
+        pass
 
 
 if __name__ == "__main__":
@@ -107,6 +946,3 @@ if __name__ == "__main__":
     print("📍 http://localhost:8000")
     print("📚 ドキュメント: http://localhost:8000/docs")
     uvicorn.run("server:app", host="0.0.0.0", port=8000, reload=True)
-
-
-
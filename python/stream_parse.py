@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+逐次解析による生成（大量の問題を含むYAML向け）
+文書全体を読み込まず、PyYAML のイベント列からトップレベルのキーを順に読み、
+大問（プリントは問題）を1件組み立てるごとに生成して出力する。
+同時に保持するのは1件分の木だけなので、メモリ使用量は文書の大きさによらない
+
+制約: 表紙・見出しに使う項目（タイトルなど）は 大問/問題 より前に書くこと
+（テンプレートと同じ順序。後ろに書かれた項目は表紙に反映されない）。
+解答・解説の部分は、もう一度イベント列を読み直して生成する
+"""
+
+import itertools
+
+import yaml
+from yaml.composer import Composer
+from yaml.constructor import SafeConstructor
+from yaml.events import DocumentStartEvent, MappingEndEvent, MappingStartEvent, SequenceEndEvent, SequenceStartEvent
+from yaml.resolver import Resolver
+
+from exam_generator import ExamGenerator
+from mathjax import has_math
+from models import ExamDocument, ExamSection, WorksheetDocument, WorksheetHeader
+from worksheet_generator import WorksheetGenerator
+from yaml_loader import SafeLoader
+
+
+class _EventComposer(Composer, SafeConstructor, Resolver):
+    """イベントのイテレータから1ノードずつ組み立てて Python の値にする（safe_load と同じ型になる）"""
+
+    def __init__(self, events):
+        self._events = events
+        self._next = None
+        Composer.__init__(self)
+        SafeConstructor.__init__(self)
+        Resolver.__init__(self)
+
+    # Composer が使うパーサーのインターフェース
+    def check_event(self, *choices):
+        event = self.peek_event()
+        if event is None:
+            return False
+        return not choices or isinstance(event, choices)
+
+    def peek_event(self):
+        if self._next is None:
+            self._next = next(self._events, None)
+        return self._next
+
+    def get_event(self):
+        event = self.peek_event()
+        self._next = None
+        return event
+
+    def construct_next(self):
+        """次のノード1つを組み立てて返す"""
+        return self.construct_document(self.compose_node(None, None))
+
+
+def iter_document(yaml_content: str, list_key: str):
+    """トップレベルのマッピングを先頭から読み、次の組を順に返す。
+        ('field', キー, 値)   … list_key 以外のキー
+        ('item', 位置, 値)    … list_key のリストの要素（1件ずつ）
+    ルートがマッピングでなければ ('root', None, 値) を1つだけ返す"""
+    composer = _EventComposer(iter(yaml.parse(yaml_content, Loader=SafeLoader)))
+    composer.get_event()  # StreamStart
+    if not composer.check_event(DocumentStartEvent):
+        yield 'root', None, None  # 空の文書
+        return
+    composer.get_event()
+    if not composer.check_event(MappingStartEvent):
+        yield 'root', None, composer.construct_next()
+        return
+    composer.get_event()
+    while not composer.check_event(MappingEndEvent):
+        key = composer.construct_next()
+        if key == list_key and composer.check_event(SequenceStartEvent):
+            composer.get_event()
+            index = 0
+            while not composer.check_event(SequenceEndEvent):
+                yield 'item', index, composer.construct_next()
+                index += 1
+            composer.get_event()
+        else:
+            yield 'field', key, composer.construct_next()
+
+
+def _check_root(kind: str, value, document_cls):
+    if kind == 'root':
+        # マッピング以外のルートはモデルと同じエラーにする
+        document_cls.parse(value)
+
+
+class StreamingExamGenerator(ExamGenerator):
+    """大問を1件ずつ解析しながら生成するテスト生成（断片は ExamGenerator と同じ）"""
+
+    def __init__(self, yaml_content: str, stylesheet_url: str | None = None, mathjax_url: str | None = None):
+        self.yaml_content = yaml_content
+        self.document = None  # 大問より前の項目から作る（大問は含まない）
+        self.stylesheet_url = stylesheet_url
+        self.mathjax_url = mathjax_url
+        self.uses_math = has_math(yaml_content)
+
+    def iter_fragments(self):
+        header = {}
+        for kind, key, value in iter_document(self.yaml_content, '大問'):
+            _check_root(kind, value, ExamDocument)
+            if kind == 'field':
+                header[key] = value
+                continue
+            if self.document is None:
+                yield from self._opening(header)
+            section = ExamSection.parse(value, f'大問[{key}]')
+            yield f'problem-{key}', self._render_problem(section)
+        if self.document is None:
+            yield from self._opening(header)
+
+        yield 'answers-head', '\n    <div class="page-break"></div>\n    ' + self._create_answers_head()
+        for kind, key, value in iter_document(self.yaml_content, '大問'):
+            if kind == 'item':
+                yield f'answer-{key}', self._render_answer(ExamSection.parse(value, f'大問[{key}]'))
+        yield 'answers-tail', '</div>'
+        yield 'tail', '\n</body>\n</html>'
+
+    def _opening(self, header):
+        self.document = ExamDocument.parse(header)
+        yield 'head', self._create_head() + '\n<body>\n    '
+        yield 'cover', self._create_cover() + '\n    <div class="page-break"></div>\n    '
+
+
+class StreamingWorksheetGenerator(WorksheetGenerator):
+    """問題を1件ずつ解析しながら生成するプリント生成（断片は WorksheetGenerator と同じ）"""
+
+    def __init__(self, yaml_content: str, stylesheet_url: str | None = None, mathjax_url: str | None = None):
+        self.yaml_content = yaml_content
+        self.document = None
+        self.stylesheet_url = stylesheet_url
+        self.mathjax_url = mathjax_url
+        self.uses_math = has_math(yaml_content)
+
+    def iter_fragments(self):
+        header = {}
+        for kind, key, value in iter_document(self.yaml_content, '問題'):
+            _check_root(kind, value, WorksheetDocument)
+            if kind == 'field':
+                header[key] = value
+                continue
+            if self.document is None:
+                yield from self._opening(header)
+            prob = WorksheetDocument.parse_problem(value, key)
+            yield f'problem-{key}', self._render_problem(prob)
+        if self.document is None:
+            yield from self._opening(header)
+
+        # 解答を作成 は問題より後ろに書かれていてもよい
+        if not WorksheetDocument.parse(header).make_answers:
+            yield 'answers-head', '\n    '
+            yield 'tail', '\n</body>\n</html>'
+            return
+        yield 'answers-head', '\n    ' + self._create_answers_head()
+        answers = 0
+        for kind, key, value in iter_document(self.yaml_content, '問題'):
+            if kind != 'item':
+                continue
+            prob = WorksheetDocument.parse_problem(value, key)
+            if isinstance(prob, WorksheetHeader):
+                continue
+            yield f'answer-{answers}', self._render_answer(prob)
+            answers += 1
+        yield 'answers-tail', '</div>'
+        yield 'tail', '\n</body>\n</html>'
+
+    def _opening(self, header):
+        self.document = WorksheetDocument.parse(header)
+        yield 'head', self._create_head() + '\n<body>\n    '
+        yield 'header', self._create_header() + '\n    '
+        yield 'title', self._create_title() + '\n    '
+
+
+def _primed(generator):
+    """最初の断片（大問/問題より前の解析を含む）を先に作り、YAMLの誤りを送信開始前に検出する"""
+    chunks = generator.iter_html()
+    return itertools.chain([next(chunks)], chunks)
+
+
+def iter_exam_html_streaming(yaml_content: str, stylesheet_url: str | None = None, mathjax_url: str | None = None):
+    """YAML文字列から大問ごとに解析しながらHTMLを断片ごとに生成"""
+    return _primed(StreamingExamGenerator(yaml_content, stylesheet_url, mathjax_url))
+
+
+def iter_worksheet_html_streaming(yaml_content: str, stylesheet_url: str | None = None,
+                                  mathjax_url: str | None = None):
+    """YAML文字列から問題ごとに解析しながらHTMLを断片ごとに生成"""
+    return _primed(StreamingWorksheetGenerator(yaml_content, stylesheet_url, mathjax_url))
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文書種別ごとのスタイルシート管理
+CSSをインライン埋め込みするか、内容ハッシュ付きURLの外部ファイルとして参照するかを切り替える
+"""
+
+import hashlib
+
+
+def style_block(css: str, stylesheet_url: str | None = None) -> str:
+    """<head> 内に置くスタイル指定（URL指定時は <link>、なければインライン <style>）"""
+    if stylesheet_url:
+        return f'    <link rel="stylesheet" href="{stylesheet_url}">'
+    return f'    <style>\n{css}\n    </style>'
+
+
+class StylesheetRegistry:
+    """文書種別名 → CSS の対応と、内容ハッシュによるバージョンを保持する"""
+
+    def __init__(self):
+        self._sheets: dict[str, tuple[str, str]] = {}
+
+    def register(self, name: str, css: str):
+        version = hashlib.sha256(css.encode('utf-8')).hexdigest()[:12]
+        self._sheets[name] = (version, css)
+
+    def filename(self, name: str) -> str:
+        """URLに使うファイル名（例: exam.1a2b3c4d5e6f.css）"""
+        version, _ = self._sheets[name]
+        return f'{name}.{version}.css'
+
+    def lookup(self, filename: str) -> tuple[str, str] | None:
+        """ファイル名から (バージョン, CSS) を返す。古いバージョンや未登録なら None"""
+        name, _, rest = filename.partition('.')
+        version = rest.removesuffix('.css')
+        sheet = self._sheets.get(name)
+        if sheet is None or sheet[0] != version:
+            return None
+        return sheet
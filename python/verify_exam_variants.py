@@ -0,0 +1,92 @@
+import re
+import sys
+from exam_variants import generate_exam_variants, remap_choice_answer
+
+VARIANT_COUNT = 8
+
+# 指示文（文字列だけの小問）＋ 選択肢つきの小問2つ
+yaml_content = """
+タイトル: "並べ替え検証"
+科目: "数学"
+大問:
+  - 番号: 1
+    タイトル: "選択問題"
+    小問:
+      - "次の問いに答えよ。"
+      - 番号: "(1)"
+        本文: "1 + 1 は？"
+        選択肢: ["1", "2", "3", "4"]
+        解答: "イ"
+      - 番号: "(2)"
+        本文: "偶数をすべて選べ"
+        選択肢: ["1", "2", "3", "4"]
+        解答: "イ、エ"
+"""
+
+
+def _items(html):
+    """問題部分の小問を (番号, 本文) のリストで返す"""
+    problems = html.split('<div class="answer-page">')[0]
+    return re.findall(
+        r'<div class="problem-item-num">(.*?)</div>\s*<div class="problem-item-body">(.*?)</div>\s*</div>',
+        problems,
+        re.S,
+    )
+
+
+def test_plain_items_stay_in_place():
+    print("Testing Plain Items in Variants...")
+    variants = generate_exam_variants(yaml_content, VARIANT_COUNT, seed=1, shuffle_choices=True)
+    orders = set()
+    for variant in variants:
+        items = _items(variant['html'])
+        numbers = [num for num, _ in items]
+        if numbers != ['', '(1)', '(2)'] or '次の問いに答えよ。' not in items[0][1]:
+            print(f"❌ {variant['label']}版: 指示文の位置か小問の番号がずれています: {numbers}")
+            return False
+        orders.add(tuple('1 + 1' in body for _, body in items[1:]))
+        for entry in variant['answer_key'][0]['小問']:
+            if entry['番号'] not in ('(1)', '(2)') or entry['元の番号'] not in ('(1)', '(2)'):
+                print(f"❌ {variant['label']}版: 解答一覧の番号が不正です: {entry}")
+                return False
+    print("✅ 指示文は先頭に固定され、番号のある小問だけが (1), (2) の順に並んでいます")
+    if len(orders) < 2:
+        print("❌ 小問が並べ替えられていません")
+        return False
+    print("✅ 番号のある小問が版によって並べ替えられています")
+    return True
+
+
+def test_multi_label_remap():
+    print("\nTesting Multi-Label Answer Remapping...")
+    choices = ["1", "2", "3", "4"]
+    order = [3, 1, 0, 2]  # 表示順に並べた元の位置（元のイ→イ、元のエ→ア）
+    cases = [
+        ("イ", "イ"),
+        ("エ", "ア"),
+        ("イ、エ", "イ、ア"),
+        ("イ,エ", "イ,ア"),
+        ("イ ・ エ", "イ ・ ア"),
+        (["イ", "エ"], ["イ", "ア"]),
+        ("4", "ア"),  # 選択肢の文言で書かれた解答
+        ("イとエ", "イとエ"),  # 記号として読めない解答はそのまま
+    ]
+    for answer, expected in cases:
+        result = remap_choice_answer(answer, choices, order)
+        if result != expected:
+            print(f"❌ {answer!r} → {result!r}（期待値 {expected!r}）")
+            return False
+    print("✅ 単一・複数の記号、リスト、選択肢の文言の解答が正しく置き換えられています")
+    return True
+
+
+if __name__ == "__main__":
+    success_plain = test_plain_items_stay_in_place()
+    success_remap = test_multi_label_remap()
+
+    if success_plain and success_remap:
+        print("\n✨ 全ての検証テストに合格しました！")
+        sys.exit(0)
+    else:
+        print("\n💥 検証テスト失敗...")
+        sys.exit(1)
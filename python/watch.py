@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ウォッチモード
+ディレクトリ配下のYAMLをポーリングで監視し、保存されたファイルだけを生成し直して
+購読中のブラウザ（SSE）へ新しい出力を送る。
+短時間に続く書き込みは、ファイルが落ち着いてから1回の生成にまとめる
+
+使い方: python watch.py <ディレクトリ> [ポート]
+    （KYOZAI_WATCH_DIR を設定してサーバーを起動するのと同じ）
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+
+from bulk_export import find_documents
+from workers import RENDERERS
+from yaml_loader import detect_doctype, load_yaml
+
+POLL_INTERVAL = float(os.environ.get('KYOZAI_WATCH_INTERVAL', 0.1))
+DEBOUNCE_SECONDS = float(os.environ.get('KYOZAI_WATCH_DEBOUNCE', 0.05))
+SUBSCRIBER_QUEUE_SIZE = 16
+
+
+def render_path(root: str, relative: str) -> dict:
+    """1ファイルを生成し、購読者に送るイベントを返す（ワーカー内で呼ぶ）"""
+    event = {'type': 'update', 'path': relative, 'doctype': None, 'html': '', 'error': None}
+    try:
+        with open(os.path.join(root, relative), encoding='utf-8') as f:
+            yaml_content = f.read()
+        doctype = detect_doctype(load_yaml(yaml_content))
+        if doctype is None:
+            event['error'] = 'unknown document type'
+            return event
+        event['doctype'] = doctype
+        event['html'] = RENDERERS[doctype](yaml_content)
+    except Exception as e:
+        event['error'] = f'{type(e).__name__}: {e}'
+    return event
+
+
+def format_sse(event: dict, event_id: int | None = None) -> str:
+    """Server-Sent Events の1件分"""
+    lines = [f"event: {event['type']}"]
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append('data: ' + json.dumps(event, ensure_ascii=False))
+    return '\n'.join(lines) + '\n\n'
+
+
+class WatchService:
+    """監視対象ディレクトリの状態と購読者を管理する"""
+
+    def __init__(self, root: str, run=None, interval: float = POLL_INTERVAL, debounce: float = DEBOUNCE_SECONDS):
+        self.root = os.path.realpath(root)
+        # run(func, *args) はワーカーで実行するコルーチン（既定はスレッド）
+        self._run = run or asyncio.to_thread
+        self.interval = interval
+        self.debounce = debounce
+        self.revision = 0
+        self.documents: dict[str, dict] = {}  # 相対パス → 最新のイベント
+        self._signatures: dict[str, tuple] = {}
+        self._pending: dict[str, tuple[tuple | None, float]] = {}  # 相対パス → (署名, 最後に変化を見た時刻)
+        self._subscribers: set[asyncio.Queue] = set()
+        self._task: asyncio.Task | None = None
+
+    def _scan(self) -> dict[str, tuple]:
+        signatures = {}
+        for path in find_documents(self.root):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            relative = os.path.relpath(path, self.root).replace(os.sep, '/')
+            signatures[relative] = (stat.st_mtime_ns, stat.st_size)
+        return signatures
+
+    def start(self):
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _watch(self):
+        # 起動時点のファイルは生成せずに記録だけする（要求されたときに生成する）
+        self._signatures = await asyncio.to_thread(self._scan)
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.poll()
+
+    async def poll(self):
+        """変化を確認し、落ち着いたファイルを生成し直す"""
+        current = await asyncio.to_thread(self._scan)
+        now = time.monotonic()
+        for relative in set(current) | set(self._signatures):
+            signature = current.get(relative)
+            if signature != self._signatures.get(relative):
+                pending = self._pending.get(relative)
+                if pending is None or pending[0] != signature:
+                    self._pending[relative] = (signature, now)
+
+        for relative, (signature, changed_at) in list(self._pending.items()):
+            if now - changed_at < self.debounce:
+                continue
+            del self._pending[relative]
+            if signature is None:
+                self._signatures.pop(relative, None)
+                self.documents.pop(relative, None)
+                self._publish({'type': 'removed', 'path': relative})
+            else:
+                self._signatures[relative] = signature
+                try:
+                    await self._render(relative)
+                except Exception:
+                    # ワーカーが満杯などで生成できなかった場合は次のポーリングで再試行する
+                    self._pending[relative] = (signature, now)
+
+    async def _render(self, relative: str) -> dict:
+        event = await self._run(render_path, self.root, relative)
+        self.documents[relative] = event
+        self._publish(event)
+        return event
+
+    def _publish(self, event: dict):
+        self.revision += 1
+        event['revision'] = self.revision
+        for queue in self._subscribers:
+            if queue.full():
+                # 遅い購読者には古いイベントを捨てて最新を届ける
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def files(self) -> list[str]:
+        return sorted(self._signatures)
+
+    async def get(self, relative: str) -> dict | None:
+        """最新の出力（まだ生成していなければここで生成する）。監視対象外なら None"""
+        if relative not in self._signatures:
+            return None
+        event = self.documents.get(relative)
+        if event is None:
+            event = await self._render(relative)
+        return event
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+
+# /watch/{path} で返すページに差し込むスクリプト（更新があれば再読み込み）
+RELOAD_SCRIPT = """<script>
+    (function () {{
+        var source = new EventSource({url});
+        source.addEventListener('update', function () {{ location.reload(); }});
+    }})();
+</script>"""
+
+
+def with_reload_script(html: str, events_url: str) -> str:
+    script = RELOAD_SCRIPT.format(url=json.dumps(events_url))
+    index = html.rfind('</body>')
+    if index < 0:
+        return html + script
+    return html[:index] + script + '\n' + html[index:]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    os.environ['KYOZAI_WATCH_DIR'] = sys.argv[1]
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8000
+    import uvicorn
+    print(f'👀 {os.path.abspath(sys.argv[1])} を監視中: http://localhost:{port}/watch/')
+    uvicorn.run('server:app', host='127.0.0.1', port=port)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+生成ワーカー
+CPU負荷の高い生成処理をイベントループ外のワーカーで実行する
+（通常リクエスト用の上限付きディスパッチャーと、一括生成用のプロセスプール）
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from metrics import call_capturing, registry
+from exam_generator import generate_exam_html
+from worksheet_generator import generate_worksheet_html
+from lesson_plan_generator import generate_lesson_plan_html, generate_lesson_plan_docx_base64
+
+
+# 文書種別 → 生成関数（プロセス間では関数ではなく種別名を受け渡す）
+RENDERERS = {
+    "exam": generate_exam_html,
+    "worksheet": generate_worksheet_html,
+    "lesson-plan": generate_lesson_plan_html,
+    "lesson-plan-docx": generate_lesson_plan_docx_base64,
+}
+
+
+def render_document(doctype: str, yaml_content: str) -> tuple[bool, str]:
+    """1文書を生成し (成功フラグ, 出力またはエラーメッセージ) を返す"""
+    try:
+        return True, RENDERERS[doctype](yaml_content)
+    except Exception as e:
+        return False, str(e)
+
+
+def render_with_name(generator_cls, render, yaml_content: str, *options) -> tuple:
+    """生成結果とダウンロード時のファイル名（拡張子なし）を返す"""
+    return render(yaml_content, *options), generator_cls(yaml_content).download_name()
+
+
+def download_name(generator_cls, yaml_content: str) -> str:
+    """ダウンロード時のファイル名（拡張子なし）"""
+    return generator_cls(yaml_content).download_name()
+
+
+class BatchRenderer:
+    """一括生成用のプロセスプール（初回利用時に起動する）"""
+
+    def __init__(self, max_workers: int | None = None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor: ProcessPoolExecutor | None = None
+
+    def executor(self) -> ProcessPoolExecutor:
+        """共有のプロセスプール（ZIPエクスポートもこのプールで生成する）"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    async def render_many(self, doctype: str, yaml_contents: list[str]) -> list[tuple[bool, str]]:
+        """複数文書を並列に生成し、入力と同じ順序で結果を返す"""
+        if doctype not in RENDERERS:
+            raise ValueError(f"unknown document type: {doctype}")
+        loop = asyncio.get_running_loop()
+        executor = self.executor()
+        futures = [
+            loop.run_in_executor(executor, call_capturing, render_document, doctype, yaml_content)
+            for yaml_content in yaml_contents
+        ]
+        results = []
+        for result, records in await asyncio.gather(*futures):
+            # 子プロセスで計測したフェーズ別所要時間などを、このプロセスの /metrics に反映する
+            registry.replay(records)
+            results.append(result)
+        return results
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+class RenderQueueFull(Exception):
+    """待ち行列が上限に達しており、新しい生成要求を受け付けられない"""
+
+
+class RenderSlot:
+    """確保した1件分の枠（RenderDispatcher.reserve() など）。release は何度呼んでもよい"""
+
+    def __init__(self, release):
+        self._release = release
+
+    def release(self):
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
+    # 使われないまま捨てられた場合（送信開始前の切断など）も枠を返す
+    __del__ = release
+
+
+class RenderDispatcher:
+    """生成処理をスレッド/プロセスプールに送り、待ち行列の深さを制限する"""
+
+    def __init__(self, kind: str = "thread", max_workers: int | None = None, max_queue: int = 32):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"unknown executor kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self._executor: Executor | None = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="render")
+        return self._executor
+
+    def _admit(self):
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                raise RenderQueueFull()
+            self._pending += 1
+
+    def reserve(self) -> RenderSlot:
+        """ワーカーに送らずに行う生成（ストリーミングなど）の分の枠を確保する（上限超過時は RenderQueueFull）"""
+        self._admit()
+        return RenderSlot(lambda: self._on_done(None))
+
+    async def run(self, func, *args):
+        """func(*args) をワーカーで実行して結果を返す（上限超過時は RenderQueueFull）"""
+        self._admit()
+        # 呼び出し側がキャンセルされても、ワーカーの処理が終わるまでは件数に含める
+        if self.kind == "process":
+            future = self._get_executor().submit(call_capturing, func, *args)
+        else:
+            future = self._get_executor().submit(func, *args)
+        future.add_done_callback(self._on_done)
+        result = await asyncio.wrap_future(future)
+        if self.kind == "process":
+            # 子プロセスで計測したフェーズ別所要時間などを、このプロセスの /metrics に反映する
+            result, records = result
+            registry.replay(records)
+        return result
+
+    def _on_done(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    def stats(self) -> dict:
+        in_flight = min(self._pending, self.max_workers)
+        return {
+            "executor": self.kind,
+            "workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": in_flight,
+            "queue_depth": self._pending - in_flight,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
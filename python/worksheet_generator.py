@@ -5,58 +5,37 @@
 YAMLコンテンツからHTML形式のプリント（ワークシート）を生成する
 """
 
-import yaml
-import markdown
+from downloads import safe_filename
+from mathjax import has_math, head_scripts
+from markdown_engine import render_markdown
+from metrics import phase
+from models import WorksheetHeader, load_worksheet
+from render_cache import content_hash, fragment_cache, fragment_keys
+from stylesheets import style_block
 
 
-class WorksheetGenerator:
-    def __init__(self, yaml_content: str):
-        """YAMLコンテンツから初期化"""
-        self.data = yaml.safe_load(yaml_content)
-
-    def generate_html(self) -> str:
-        """HTML文字列を生成して返す"""
-        return self._build_html()
-
-    def _build_html(self):
-        return f"""<!DOCTYPE html>
-<html lang="ja">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{self.data.get('タイトル', 'プリント')}</title>
-    <script id="MathJax-script" async src="https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-mml-chtml.js"></script>
-    <script>
-        MathJax = {{
-            tex: {{
-                inlineMath: [['$', '$']],
-                displayMath: [['$$', '$$']],
-                processEscapes: true
-            }}
-        }};
-    </script>
-    <style>
-        @media print {{
-            @page {{ size: A4; margin: 20mm; }}
-            .page-break {{ page-break-after: always; }}
-            body {{
+WORKSHEET_CSS = """\
+        @media print {
+            @page { size: A4; margin: 20mm; }
+            .page-break { page-break-after: always; }
+            body {
                 width: 100% !important;
                 max-width: none !important;
                 margin: 0 !important;
                 padding: 0 !important;
-            }}
-        }}
+            }
+        }
 
         /* 画面プレビュー用：改ページ位置を可視化 */
-        @media screen {{
-            .page-break, [style*="break-before: page"], [style*="break-after: page"] {{
+        @media screen {
+            .page-break, [style*="break-before: page"], [style*="break-after: page"] {
                 border-top: 4px dashed #ddd !important;
                 margin-top: 40px !important;
                 padding-top: 40px !important;
                 position: relative;
                 display: block;
-            }}
-            .page-break::before, [style*="break-before: page"]::before, [style*="break-after: page"]::before {{
+            }
+            .page-break::before, [style*="break-before: page"]::before, [style*="break-after: page"]::before {
                 content: "--- 改ページ ---";
                 display: block;
                 position: absolute;
@@ -68,55 +47,55 @@ class WorksheetGenerator:
                 font-weight: bold;
                 background: #fff;
                 padding: 0 10px;
-            }}
-        }}
-        body {{ 
+            }
+        }
+        body { 
             font-family: 'Hiragino Mincho ProN', 'Yu Mincho', serif; 
             line-height: 1.8; 
             max-width: 210mm; 
             margin: 0 auto; 
             padding: 20px;
             color: #333;
-        }}
+        }
         
         /* ヘッダー */
-        .header {{
+        .header {
             display: flex;
             justify-content: flex-end;
             margin-bottom: 20px;
             font-size: 12pt;
-        }}
-        .header-field {{
+        }
+        .header-field {
             margin-left: 20px;
-        }}
-        .header-field .label {{
+        }
+        .header-field .label {
             margin-right: 5px;
-        }}
-        .header-field .underline {{
+        }
+        .header-field .underline {
             display: inline-block;
             border-bottom: 1px solid #333;
             min-width: 80px;
-        }}
-        .header-field.name .underline {{
+        }
+        .header-field.name .underline {
             min-width: 200px;
-        }}
+        }
         
         /* タイトル */
-        .title {{
+        .title {
             text-align: center;
             font-size: 20pt;
             font-weight: bold;
             margin: 30px 0 10px;
-        }}
-        .subtitle {{
+        }
+        .subtitle {
             text-align: center;
             font-size: 14pt;
             color: #555;
             margin-bottom: 30px;
-        }}
+        }
         
         /* セクション */
-        .section-header {{
+        .section-header {
             font-size: 14pt;
             font-weight: bold;
             text-align: center;
@@ -124,80 +103,143 @@ class WorksheetGenerator:
             padding: 10px;
             background: #f5f5f5;
             border-radius: 5px;
-        }}
+        }
         
         /* 問題 */
-        .problem {{
+        .problem {
             margin: 25px 0;
-        }}
-        .problem-header {{
+        }
+        .problem-header {
             display: flex;
             align-items: baseline;
             margin-bottom: 10px;
-        }}
-        .problem-number {{
+        }
+        .problem-number {
             font-weight: bold;
             font-size: 14pt;
             margin-right: 15px;
-        }}
-        .problem-text {{
+        }
+        .problem-text {
             font-size: 11pt;
             flex: 1;
-        }}
-        .problem-score {{
+        }
+        .problem-score {
             font-size: 10pt;
             color: #666;
             margin-left: 10px;
-        }}
-        .sub-problems {{
+        }
+        .sub-problems {
             margin-left: 30px;
             margin-top: 10px;
-        }}
-        .sub-problem {{
+        }
+        .sub-problem {
             margin: 8px 0;
-        }}
-        .answer-space {{
+        }
+        .answer-space {
             height: 100px;
             margin: 15px 0;
-        }}
+        }
         
         /* 解答ページ */
-        .answer-page {{
+        .answer-page {
             margin-top: 40px;
             padding-top: 20px;
             border-top: 3px double #333;
-        }}
-        .answer-page h2 {{
+        }
+        .answer-page h2 {
             text-align: center;
             margin-bottom: 30px;
-        }}
-        .answer-item {{
+        }
+        .answer-item {
             margin: 15px 0;
             padding: 10px;
             background: #fafafa;
             border-radius: 5px;
-        }}
-        .answer-correct {{
+        }
+        .answer-correct {
             font-weight: bold;
             color: #d00;
-        }}
-        .answer-explanation {{
+        }
+        .answer-explanation {
             margin-top: 10px;
             font-size: 10pt;
             color: #555;
             padding: 10px;
             background: #fff;
             border-left: 3px solid #3b82f6;
-        }}
-    </style>
-</head>
-<body>
-    {self._create_header()}
-    {self._create_title()}
-    {self._create_problems()}
-    {self._create_answers() if self.data.get('解答を作成', True) else ''}
-</body>
-</html>"""
+        }"""
+
+
+class WorksheetGenerator:
+    def __init__(self, yaml_content: str, stylesheet_url: str | None = None, mathjax_url: str | None = None):
+        """YAMLコンテンツから初期化（stylesheet_url 指定時はCSSを外部参照に、mathjax_url 指定時はそこからMathJaxを読み込む）"""
+        with phase('worksheet', 'yaml_parse'):
+            self.document = load_worksheet(yaml_content)
+        self.stylesheet_url = stylesheet_url
+        self.mathjax_url = mathjax_url
+        self.uses_math = has_math(yaml_content)
+
+    def generate_html(self) -> str:
+        """HTML文字列を生成して返す"""
+        return self._build_html()
+
+    def download_name(self) -> str:
+        """ダウンロード時のファイル名（拡張子なし）"""
+        return safe_filename(self._title('プリント'), default='プリント')
+
+    def iter_html(self):
+        """HTMLを断片ごとに順次生成（ストリーミング用）"""
+        for _, html in self.iter_fragments():
+            yield html
+
+    def iter_fragments(self, known=frozenset()):
+        """(断片ID, HTML) を文書順に生成。連結すると generate_html() と同じ内容になる。
+
+        問題と解答の断片IDは問題の内容（と表示する番号）のハッシュから作るので、前後の編集では変わらない。
+        known に含まれるIDの問題・解答は生成せず、HTMLを None にする（ライブプレビュー用）
+        """
+        problems = self.document.problems
+        keys = fragment_keys(self._content_key(prob) for prob in problems)
+        yield 'head', self._create_head() + '\n<body>\n    '
+        yield 'header', self._create_header() + '\n    '
+        yield 'title', self._create_title() + '\n    '
+        skip = {i for i, key in enumerate(keys) if f'problem-{key}' in known}
+        for key, html in zip(keys, self._iter_problems(skip)):
+            yield f'problem-{key}', html
+        if self.document.make_answers:
+            yield 'answers-head', '\n    ' + self._create_answers_head()
+            # 見出しには解答がない
+            keys = [key for key, prob in zip(keys, problems) if not isinstance(prob, WorksheetHeader)]
+            skip = {i for i, key in enumerate(keys) if f'answer-{key}' in known}
+            for key, html in zip(keys, self._iter_answers(skip)):
+                yield f'answer-{key}', html
+            yield 'answers-tail', '</div>'
+        else:
+            yield 'answers-head', '\n    '
+        yield 'tail', '\n</body>\n</html>'
+
+    def _build_html(self):
+        with phase('worksheet', 'html_assembly'):
+            return ''.join(self.iter_html())
+
+    def _title(self, default):
+        return default if self.document.title is None else self.document.title
+
+    def _mathjax_scripts(self):
+        """数式を含む文書のときだけMathJaxを読み込む"""
+        if not self.uses_math:
+            return ''
+        return head_scripts(self.mathjax_url)
+
+    def _create_head(self):
+        return f"""<!DOCTYPE html>
+<html lang="ja">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{self._title('プリント')}</title>
+{self._mathjax_scripts()}{style_block(WORKSHEET_CSS, self.stylesheet_url)}
+</head>"""
 
     def _create_header(self):
         return """
@@ -209,8 +251,8 @@ class WorksheetGenerator:
     </div>"""
 
     def _create_title(self):
-        title = self.data.get('タイトル', '')
-        subtitle = self.data.get('サブタイトル', '')
+        title = self._title('')
+        subtitle = self.document.subtitle
         
         html = f'<h1 class="title">{title}</h1>'
         if subtitle:
@@ -218,97 +260,125 @@ class WorksheetGenerator:
         return html
 
     def _create_problems(self):
-        problems = self.data.get('問題', [])
-        html = ""
-        
-        for i, prob in enumerate(problems):
-            # セクションヘッダー
-            if prob.get('type') == 'header':
-                # ヘッダーにも改ページ適用可能
-                hb_style = ""
-                if prob.get('改ページ', False):
-                    hb_style = ' style="page-break-before: always; break-before: page;"'
-                html += f'<div class="section-header"{hb_style}>{prob.get("text", "")}</div>'
+        return ''.join(self._iter_problems())
+
+    @staticmethod
+    def _content_key(prob) -> str:
+        """問題の部分木と表示する番号のハッシュ（番号の既定値は位置で決まるため。見出しは部分木だけ）"""
+        if isinstance(prob, WorksheetHeader):
+            return prob.digest
+        return content_hash(f'{prob.digest}:{prob.number}')
+
+    def _iter_problems(self, skip=frozenset()):
+        """問題ごとのHTML（skip に含まれる位置は None）"""
+        for i, prob in enumerate(self.document.problems):
+            if i in skip:
+                yield None
                 continue
-            
-            # 問題の改ページチェック
-            pb_style = ""
-            if prob.get('改ページ', False):
-                pb_style = ' style="page-break-before: always; break-before: page;"'
-            
-            num = prob.get('番号', i + 1)
-            text = prob.get('本文', '')
-            score = prob.get('配点')
-            sub_problems = prob.get('小問', [])
-            spaces = prob.get('スペース', 5)
-            
-            score_html = f'<span class="problem-score">[{score}点]</span>' if score else ''
-            text_html = markdown.markdown(text) if text else ''
-            
-            html += f"""
+            # 問題ごとに断片をキャッシュ（前に問題を挿入・削除しても、番号が変わらなければ再生成しない）
+            key = f"worksheet-problem:{self._content_key(prob)}"
+            yield fragment_cache.get_or_render(key, lambda: self._render_problem(prob)).value
+
+    def _render_problem(self, prob):
+        # セクションヘッダー
+        if isinstance(prob, WorksheetHeader):
+            # ヘッダーにも改ページ適用可能
+            hb_style = ""
+            if prob.page_break:
+                hb_style = ' style="page-break-before: always; break-before: page;"'
+            return f'<div class="section-header"{hb_style}>{prob.text}</div>'
+        
+        # 問題の改ページチェック
+        pb_style = ""
+        if prob.page_break:
+            pb_style = ' style="page-break-before: always; break-before: page;"'
+        
+        num = prob.number
+        text = prob.body
+        score = prob.score
+        sub_problems = prob.subs
+        spaces = prob.spaces
+        
+        score_html = f'<span class="problem-score">[{score}点]</span>' if score else ''
+        text_html = render_markdown(text) if text else ''
+        
+        parts = [f"""
     <div class="problem"{pb_style}>
         <div class="problem-header">
             <span class="problem-number">{num}</span>
             <span class="problem-text">{text_html}</span>
             {score_html}
-        </div>"""
-            
-            if sub_problems:
-                html += '<div class="sub-problems">'
-                for sub in sub_problems:
-                    if isinstance(sub, str):
-                        html += f'<div class="sub-problem">{sub}</div>'
-                    elif isinstance(sub, dict):
-                        sub_text = sub.get('本文', '')
-                        sub_num = sub.get('番号', '')
-                        html += f'<div class="sub-problem">{sub_num} {sub_text}</div>'
-                html += '</div>'
-            
-            # 解答スペース
-            space_height = spaces * 20
-            html += f'<div class="answer-space" style="height: {space_height}px;"></div>'
-            html += '</div>'
+        </div>"""]
         
-        return html
+        if sub_problems:
+            parts.append('<div class="sub-problems">')
+            for sub_num, sub_text in sub_problems:
+                if sub_num is None:
+                    parts.append(f'<div class="sub-problem">{sub_text}</div>')
+                else:
+                    parts.append(f'<div class="sub-problem">{sub_num} {sub_text}</div>')
+            parts.append('</div>')
+        
+        # 解答スペース
+        space_height = spaces * 20
+        parts.append(f'<div class="answer-space" style="height: {space_height}px;"></div>')
+        parts.append('</div>')
+        return ''.join(parts)
 
     def _create_answers(self):
-        problems = self.data.get('問題', [])
-        html = """
+        return self._create_answers_head() + ''.join(self._iter_answers()) + '</div>'
+
+    def _create_answers_head(self):
+        return """
     <div class="page-break"></div>
     <div class="answer-page">
         <h2>解答・解説</h2>"""
-        
-        for i, prob in enumerate(problems):
-            if prob.get('type') == 'header':
+
+    def _iter_answers(self, skip=frozenset()):
+        """見出しを除いた問題ごとの解答HTML（skip は解答の中での位置。含まれる位置は None）"""
+        position = -1
+        for prob in self.document.problems:
+            if isinstance(prob, WorksheetHeader):
                 continue
-            
-            num = prob.get('番号', i + 1)
-            answers = prob.get('解答', [])
-            explanation = prob.get('解説', '')
-            
-            if not answers and not explanation:
+            position += 1
+            if position in skip:
+                yield None
                 continue
-            
-            html += f'<div class="answer-item"><strong>{num}</strong>'
-            
-            if answers:
-                if isinstance(answers, list):
-                    for ans in answers:
-                        html += f' <span class="answer-correct">答: {ans}</span>'
-                else:
-                    html += f' <span class="answer-correct">答: {answers}</span>'
-            
-            if explanation:
-                exp_html = markdown.markdown(str(explanation))
-                html += f'<div class="answer-explanation">【解説】{exp_html}</div>'
-            
-            html += '</div>'
+            key = f"worksheet-answer:{self._content_key(prob)}"
+            yield fragment_cache.get_or_render(key, lambda: self._render_answer(prob)).value
+
+    def _render_answer(self, prob):
+        num = prob.number
+        answers = prob.answers
+        explanation = prob.explanation
         
-        html += '</div>'
-        return html
+        if not answers and not explanation:
+            return ''
+        
+        parts = [f'<div class="answer-item"><strong>{num}</strong>']
+        
+        if answers:
+            if isinstance(answers, list):
+                for ans in answers:
+                    parts.append(f' <span class="answer-correct">答: {ans}</span>')
+            else:
+                parts.append(f' <span class="answer-correct">答: {answers}</span>')
+        
+        if explanation:
+            exp_html = render_markdown(explanation)
+            parts.append(f'<div class="answer-explanation">【解説】{exp_html}</div>')
+        
+        parts.append('</div>')
+        return ''.join(parts)
 
 
-def generate_worksheet_html(yaml_content: str) -> str:
+def generate_worksheet_html(yaml_content: str, stylesheet_url: str | None = None, mathjax_url: str | None = None) -> str:
     """YAML文字列からHTML文字列を生成"""
-    generator = WorksheetGenerator(yaml_content)
+    generator = WorksheetGenerator(yaml_content, stylesheet_url, mathjax_url)
     return generator.generate_html()
+
+
+def iter_worksheet_html(yaml_content: str, stylesheet_url: str | None = None, mathjax_url: str | None = None):
+    """YAML文字列からHTMLを断片ごとに生成（YAMLの解析はこの時点で行う）"""
+    generator = WorksheetGenerator(yaml_content, stylesheet_url, mathjax_url)
+    return generator.iter_html()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+YAML読み込み
+libyaml（CSafeLoader）があれば使用し、同一内容の解析結果をキャッシュする
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import yaml
+
+from render_cache import content_hash
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+class ParsedDocumentCache:
+    """内容ハッシュ → 解析済みデータ のLRU（スレッドセーフ）
+
+    parse を指定するとYAML文字列をそれで変換した結果をキャッシュする（既定はYAMLの解析のみ）。
+    返すオブジェクトは呼び出し元間で共有されるため、ジェネレーター側では変更しないこと。
+    """
+
+    def __init__(self, max_entries: int, parse=None):
+        self.max_entries = max_entries
+        self._parse = parse or (lambda text: yaml.load(text, Loader=SafeLoader))
+        self._entries: OrderedDict[str, object] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, yaml_content: str):
+        key = content_hash(yaml_content)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        data = self._parse(yaml_content)
+
+        if self.max_entries > 0:
+            with self._lock:
+                self._entries[key] = data
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'loader': SafeLoader.__name__,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+parsed_cache = ParsedDocumentCache(int(os.environ.get('KYOZAI_YAML_CACHE_SIZE', 64)))
+
+
+def load_yaml(yaml_content: str):
+    """YAML文字列を解析（同一内容なら前回の解析結果を返す）"""
+    return parsed_cache.load(yaml_content)
+
+
+# 指導案に特有のキー（いずれかがあれば指導案とみなす）
+_LESSON_PLAN_KEYS = ('展開', '授業展開', '単元名', '本時の目標')
+
+
+def detect_doctype(data) -> str | None:
+    """解析済みYAMLから文書種別を判定（テスト: 大問、プリント: 問題、指導案: 展開・単元名など）"""
+    if not isinstance(data, dict):
+        return None
+    if isinstance(data.get('大問'), list):
+        return 'exam'
+    if isinstance(data.get('問題'), list):
+        return 'worksheet'
+    if any(key in data for key in _LESSON_PLAN_KEYS):
+        return 'lesson-plan'
+    return None